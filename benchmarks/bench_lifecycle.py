@@ -0,0 +1,91 @@
+"""
+Memory benchmark of repeated session create/close cycles in one process.
+
+Sessions are created with get_session and closed, RSS and memory traced by tracemalloc are sampled after
+garbage collection. Memory should stay flat after first cycles (modules are imported only once).
+Results are printed (or written with --output) as JSON.
+
+    python benchmarks/bench_lifecycle.py --cycles 1000 --files 2 --tests 2
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import project
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath('src')))
+
+
+def get_rss():
+    """ Resident set size of this process in bytes (None if /proc is not available). """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def run_cycles(test_dir, cycles, sample, profile):
+    import pytest_ifixture
+
+    samples = []
+    tracemalloc.start()
+    for cycle in range(1, cycles + 1):
+        with pytest_ifixture.get_session([str(test_dir), '-p', 'no:cacheprovider'], profile=profile) as session:
+            test = session.tests[0]
+            test.getfixturevalue(test.test._fixtureinfo.argnames[-1])
+        if cycle % sample == 0 or cycle == 1:
+            gc.collect()
+            samples.append({'cycle': cycle, 'rss': get_rss(), 'traced': tracemalloc.get_traced_memory()[0]})
+    tracemalloc.stop()
+    return samples
+
+
+def growth(samples, field):
+    """ Growth of field in bytes per cycle in the second half of the samples. """
+    half = samples[len(samples) // 2:]
+    if len(half) < 2 or half[0][field] is None:
+        return None
+    return (half[-1][field] - half[0][field]) / (half[-1]['cycle'] - half[0]['cycle'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=1000)
+    parser.add_argument('--sample', type=int, default=50, help='sample memory every SAMPLE cycles')
+    parser.add_argument('--profile', default='minimal', help='plugin profile of the sessions')
+    parser.add_argument('--workdir', help='directory for generated project (default: temporary directory)')
+    parser.add_argument('--output', help='write results to this file')
+    project.add_spec_arguments(parser)
+    options = parser.parse_args(argv)
+    spec = project.spec_from_options(options)
+
+    with tempfile.TemporaryDirectory(prefix='ifixture-bench-') as tmp:
+        test_dir = project.generate(options.workdir or tmp, spec).resolve()
+        os.chdir(str(test_dir))
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            samples = run_cycles(test_dir, options.cycles, options.sample, options.profile)
+        os.chdir('/')
+    report = {
+        'python': sys.version.split()[0],
+        'spec': dict(spec._asdict(), items=spec.items),
+        'cycles': options.cycles,
+        'rss_growth_per_cycle': growth(samples, 'rss'),
+        'traced_growth_per_cycle': growth(samples, 'traced'),
+        'samples': samples,
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark of PytestSession and PytestTest api on synthetic project (see project.py).
+
+Every round runs in fresh interpreter (pytest and test modules can't be imported twice in one process).
+Results are printed (or written with --output) as JSON, two result files can be compared with --compare.
+
+    python benchmarks/bench_session.py --preset large --rounds 3 --output after.json
+    python benchmarks/bench_session.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import project
+
+SRC_DIR = Path(__file__).resolve().parent.parent.joinpath('src')
+
+
+def run_round(test_dir, spec, lookups):
+    """ Measure one round in current process, test_dir must be current directory. """
+    timings = {}
+
+    def measure(name, func, repeat=1):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        timings[name] = (time.perf_counter() - start) / repeat
+        return result
+
+    import pytest_ifixture
+
+    session = measure('get_session', lambda: pytest_ifixture.get_session([str(test_dir)]))
+    tests = measure('tests', lambda: session.tests)
+    assert len(tests) == spec.items, (len(tests), spec.items)
+
+    name = tests[len(tests) // 2].test.name
+    test = measure('get_test_by_name', lambda: session.get_test_by_name(name), lookups)
+    measure('get_tests_for_fixture', lambda: session.get_tests_for_fixture('fx_0_0'), lookups)
+
+    # fixture used by test (the last level of DAG) and session fixture (the first level) it depends on
+    leaf = next(f for f in test.test._fixtureinfo.argnames if f.startswith('fx_'))
+    root = next(f for f in test.fixtures if f.startswith('fx_0_'))
+    measure('getfixturevalue', lambda: test.getfixturevalue(leaf))
+    measure('str', lambda: str(test))
+    measure('reset_fixture', lambda: test.reset_fixture(root))
+    test.getfixturevalue(leaf)
+    measure('teardown', test.teardown)
+    session.cleanup_session()
+    return timings
+
+
+def run_rounds(spec, rounds, lookups, workdir):
+    test_dir = project.generate(workdir, spec).resolve()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get('PYTHONPATH')])))
+    results = []
+    for _ in range(rounds):
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            subprocess.run(
+                [sys.executable, str(Path(__file__).resolve()), '--round', output.name, '--lookups', str(lookups), str(test_dir)]
+                + [f'--{f.replace("_", "-")}={v}' for f, v in spec._asdict().items()],
+                cwd=workdir, env=env, stdout=subprocess.DEVNULL, check=True,
+            )
+            results.append(json.load(output))
+    return {
+        name: {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+        for name, values in ((name, [r[name] for r in results]) for name in results[0])
+    }
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=str(SRC_DIR), universal_newlines=True,
+            stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    """ Print ratio after/before of median times for every measured operation. """
+    with open(before) as b, open(after) as a:
+        before, after = json.load(b), json.load(a)
+    if before['spec'] != after['spec']:
+        print('WARNING: results are measured on different projects', file=sys.stderr)
+    print(f"{'operation':<24}{before['commit'] or 'before':>12}{after['commit'] or 'after':>12}{'ratio':>8}")
+    for name, result in after['results'].items():
+        old = before['results'].get(name)
+        if old is None:
+            continue
+        print(f"{name:<24}{old['median']:>12.6f}{result['median']:>12.6f}{result['median'] / old['median']:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--lookups', type=int, default=100, help='number of calls of lookup methods in one round')
+    parser.add_argument('--workdir', help='directory for generated project (default: temporary directory)')
+    parser.add_argument('--output', help='write results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--round', help=argparse.SUPPRESS)
+    parser.add_argument('test_dir', nargs='?', help=argparse.SUPPRESS)
+    project.add_spec_arguments(parser)
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        compare(*options.compare)
+        return
+    spec = project.spec_from_options(options)
+    if options.round:
+        timings = run_round(Path(options.test_dir), spec, options.lookups)
+        with open(options.round, 'w') as output:
+            json.dump(timings, output)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='ifixture-bench-') as tmp:
+        results = run_rounds(spec, options.rounds, options.lookups, options.workdir or tmp)
+    report = {
+        'commit': _get_commit(),
+        'python': sys.version.split()[0],
+        'spec': dict(spec._asdict(), items=spec.items),
+        'rounds': options.rounds,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
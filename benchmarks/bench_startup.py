@@ -0,0 +1,68 @@
+"""
+Import and startup benchmark of pytest_ifixture.
+
+Every measurement runs in fresh interpreter, so cold start is measured (as in shell completion or notebook).
+Results are printed as JSON, so they can be stored and compared between versions.
+
+    python benchmarks/bench_startup.py --repeat 10 tests_dir
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent.joinpath('src')
+
+IMPORT = '''
+import time
+start = time.perf_counter()
+import pytest_ifixture
+print('elapsed', time.perf_counter() - start)
+'''
+
+SESSION = '''
+import sys, time
+start = time.perf_counter()
+import pytest_ifixture
+session = pytest_ifixture.get_session(sys.argv[2:], profile=sys.argv[1])
+print('elapsed', time.perf_counter() - start)
+'''
+
+
+def measure(code, args, cwd, repeat):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get('PYTHONPATH')])))
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-c', code] + args, cwd=cwd, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+        )
+        elapsed = [line.split()[1] for line in proc.stdout.splitlines() if line.startswith('elapsed ')]
+        times.append(float(elapsed[-1]))
+    return {'min': min(times), 'median': statistics.median(times), 'max': max(times), 'repeat': repeat}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project', nargs='?', help='directory with tests used for get_session measurement')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('pytest_args', nargs='*', default=[])
+    options = parser.parse_args(argv)
+
+    results = {
+        'python': sys.version.split()[0],
+        'import': measure(IMPORT, [], None, options.repeat),
+    }
+    if options.project:
+        for profile in ('full', 'minimal'):
+            results['get_session_' + profile] = measure(
+                SESSION, [profile] + options.pytest_args, options.project, options.repeat)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
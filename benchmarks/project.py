@@ -0,0 +1,131 @@
+"""
+Generator of synthetic pytest projects for benchmarks.
+
+Generated project has `conftest_depth` nested packages, every one with conftest.py defining fixture `dir_<level>`
+(depending on fixture of parent directory). Root conftest.py defines fixture DAG `fx_<level>_<i>`
+of `fixture_depth` levels with `fixture_width` fixtures in each level, every fixture depends on two fixtures
+of previous level. The first level is session scoped, the others are function scoped.
+Test modules are in the deepest package, every test uses one fixture from the last level of DAG,
+fixture of the deepest directory and it is parametrized `params` times.
+
+    python benchmarks/project.py /tmp/project --files 500 --tests 20 --params 4
+"""
+import argparse
+import json
+from collections import namedtuple
+from pathlib import Path
+
+
+class ProjectSpec(namedtuple('ProjectSpec', 'files, tests, params, conftest_depth, fixture_width, fixture_depth')):
+    """
+    files: number of test modules
+    tests: number of test functions in each module
+    params: parametrization fan-out of each test function
+    conftest_depth: number of nested packages with conftest.py
+    fixture_width: number of fixtures in one level of fixture DAG
+    fixture_depth: number of levels of fixture DAG
+    """
+    __slots__ = ()
+
+    @property
+    def items(self):
+        """ Number of collected test items. """
+        return self.files * self.tests * self.params
+
+    @property
+    def leaf_fixtures(self):
+        return [f'fx_{self.fixture_depth - 1}_{i}' for i in range(self.fixture_width)]
+
+
+PRESETS = {
+    'small': ProjectSpec(files=10, tests=10, params=2, conftest_depth=2, fixture_width=4, fixture_depth=3),
+    'medium': ProjectSpec(files=100, tests=20, params=2, conftest_depth=3, fixture_width=8, fixture_depth=4),
+    'large': ProjectSpec(files=500, tests=20, params=4, conftest_depth=4, fixture_width=16, fixture_depth=6),
+}
+
+
+def _fixture_dag(spec):
+    lines = ['import pytest', '']
+    for level in range(spec.fixture_depth):
+        scope = 'session' if level == 0 else 'function'
+        for i in range(spec.fixture_width):
+            deps = [] if level == 0 else sorted({f'fx_{level - 1}_{i}', f'fx_{level - 1}_{(i + 1) % spec.fixture_width}'})
+            lines += [
+                '',
+                f"@pytest.fixture(scope='{scope}')",
+                f"def fx_{level}_{i}({', '.join(deps)}):",
+                f"    yield {' + '.join(deps) if deps else '1'}",
+                '',
+            ]
+    return '\n'.join(lines)
+
+
+def _dir_fixture(level):
+    deps = f'dir_{level - 1}' if level else ''
+    return '\n'.join([
+        'import pytest', '', '',
+        '@pytest.fixture',
+        f'def dir_{level}({deps}):',
+        f"    return {repr(level) + ' + ' + deps if deps else repr(level)}",
+        '',
+    ])
+
+
+def _test_module(spec, number):
+    lines = ['import pytest', '']
+    for t in range(spec.tests):
+        fixture = spec.leaf_fixtures[(number * spec.tests + t) % spec.fixture_width]
+        lines += [
+            '',
+            f'@pytest.mark.parametrize("param", range({spec.params}))',
+            f'def test_{number}_{t}(param, {fixture}, dir_{spec.conftest_depth}):',
+            f'    assert {fixture} + dir_{spec.conftest_depth} >= 0',
+            '',
+        ]
+    return '\n'.join(lines)
+
+
+def generate(path, spec):
+    """
+    Write project described by spec to the directory path.
+
+    :param path: target directory (created if it does not exist)
+    :param spec: ProjectSpec
+    :return: Path of the directory with test modules
+    """
+    directory = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    directory.joinpath('conftest.py').write_text(_fixture_dag(spec) + '\n\n' + _dir_fixture(0))
+    for level in range(1, spec.conftest_depth + 1):
+        directory = directory.joinpath(f'pkg_{level}')
+        directory.mkdir(exist_ok=True)
+        directory.joinpath('__init__.py').write_text('')
+        directory.joinpath('conftest.py').write_text(_dir_fixture(level))
+    for number in range(spec.files):
+        directory.joinpath(f'test_{number:05}.py').write_text(_test_module(spec, number))
+    return directory
+
+
+def add_spec_arguments(parser):
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    for field in ProjectSpec._fields:
+        parser.add_argument('--' + field.replace('_', '-'), type=int, dest=field, help='overrides preset')
+
+
+def spec_from_options(options):
+    preset = PRESETS[options.preset]
+    return preset._replace(**{f: getattr(options, f) for f in preset._fields if getattr(options, f) is not None})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    add_spec_arguments(parser)
+    options = parser.parse_args(argv)
+    spec = spec_from_options(options)
+    generate(options.path, spec)
+    print(json.dumps(dict(spec._asdict(), items=spec.items)))
+
+
+if __name__ == '__main__':
+    main()
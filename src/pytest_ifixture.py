@@ -1,19 +1,92 @@
+import argparse
+import ast
+import asyncio
+import cProfile
+import contextlib
+import functools
+import gc
+import hashlib
+import importlib
 import inspect
+import io
+import json
+import mmap
+import multiprocessing
+import multiprocessing.util
+import os
+import pickle
+import pstats
+import queue
+import re
+import socket
+import statistics
+import struct
 import sys
+import tempfile
+import threading
+import time
 import traceback
-from collections import namedtuple
+import tracemalloc
+import weakref
+from collections import namedtuple, defaultdict, deque
+from concurrent import futures
 from operator import itemgetter
 
-import pytest
-from _pytest import config, main, compat
-import py
-
 import atexit
+from pluggy import HookimplMarker
+
+
+class _LazyModule:
+    """
+    Module imported on first attribute access.
+
+    Importing pytest_ifixture should be cheap (shell completion, notebooks), so pytest and its internals
+    are imported only when they are used.
+    Submodules are available as attributes too.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        module = self.__module
+        if module is None:
+            module = self.__module = importlib.import_module(self.__name)
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            try:
+                return importlib.import_module('{}.{}'.format(self.__name, attr))
+            except ImportError:
+                raise AttributeError('module {!r} has no attribute {!r}'.format(self.__name, attr))
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name)
 
-from _pytest.fixtures import FixtureDef
 
+pytest = _LazyModule('pytest')
+config = _LazyModule('_pytest.config')
+compat = _LazyModule('_pytest.compat')
+fixtures = _LazyModule('_pytest.fixtures')
+outcomes = _LazyModule('_pytest.outcomes')
+pytest_main = _LazyModule('_pytest.main')
+runner = _LazyModule('_pytest.runner')
+py = _LazyModule('py')
 
-def get_session(args=None, pytest_cmdlines=None):
+# same as pytest.hookimpl, but pytest does not need to be imported when this module is imported
+_hookimpl = HookimplMarker('pytest')
+
+# builtin plugins skipped by profile of get_session, they are not needed for interactive work with fixtures
+# (doctest and setuponly can't be skipped, pytest itself reads their options; logging and junitxml define fixtures
+# caplog and record_property, nose runs setup and teardown of nose-style tests)
+PROFILES = {
+    'full': (),
+    'minimal': ('resultlog', 'pastebin', 'stepwise', 'setupplan', 'freeze_support'),
+}
+
+
+def get_session(args=None, pytest_cmdlines=None, collection_cache=False, lazy=False, profile='full'):
     """
     Create session handler for handling tests and fixtures interactively.
     This will prepare session same way as it is classic testing pytest session.
@@ -25,40 +98,520 @@ def get_session(args=None, pytest_cmdlines=None):
 
     :param args: same list of arguments passed to the pytest for testing
     :param pytest_cmdlines: list of commands running with pytest config object, before creating session
-    :return: PytestSession
+    :param collection_cache: (default False) store collected items in pytest cache (.pytest_cache),
+        next session with same args loads test modules only when they are needed (see CollectionManifest)
+    :param lazy: (default False) do not collect tests upfront, collect only test modules needed by lookups
+        (get_test_by_name, get_tests_for_fixture, ...), see SourceFinder
+    :param profile: (default 'full') name of plugin profile from PROFILES, 'minimal' blocks builtin plugins
+        not needed for interactive work with fixtures (resultlog, pastebin, ...)
+    :return: PytestSession (close it or use it as context manager, otherwise it is cleaned up at exit)
     """
     pytest_cmdlines = pytest_cmdlines or []
-    args = args or []
-    args.append('-s')
-    plugins = None
+    args = [*(args or []), '-s']
 
     # config.main
-    conf = config._prepareconfig(args, plugins)
+    conf = _prepare_config(args, PROFILES[profile])
 
     for pcmd in pytest_cmdlines:
         pcmd(conf)
 
     # main.wrap_session
     try:
-        session = main.Session.from_config(config=conf)
+        session = pytest_main.Session.from_config(config=conf)
     except AttributeError:
-        session = main.Session(conf)
-
-    cleanup = lambda: cleanup_config(conf, session)
-    atexit.register(cleanup)
+        session = pytest_main.Session(conf)
+    session.exitstatus = 0
+
+    cleanup = SessionCleanup(conf, session)
+
+    index = TestIndex()
+    conf.pluginmanager.register(index, 'ifixture-index')
+    conf.pluginmanager.register(SessionState(), 'ifixture-state')
+    conf.pluginmanager.register(FixtureSources(index), 'ifixture-sources')
+    conf.pluginmanager.register(FixtureOverrides(session), 'ifixture-overrides')
+    conf.pluginmanager.register(AsyncFixtures(), 'ifixture-async')
+    conf.pluginmanager.register(Snapshots(), 'ifixture-snapshots')
+    conf.pluginmanager.register(FixtureTimings(), 'ifixture-timings')
+    conf.pluginmanager.register(FixtureMemory(), 'ifixture-memory')
+    conf.pluginmanager.register(FixtureGraph(), 'ifixture-graph')
+    conf.pluginmanager.register(FixtureCache(), 'ifixture-cache')
+    conf.pluginmanager.register(TeardownQueue(), 'ifixture-teardowns')
 
     try:
         conf._do_configure()
         conf.hook.pytest_sessionstart(session=session)
-        conf.hook.pytest_collection(session=session)
+        cache_key = CollectionManifest.get_cache_key(conf, args) if collection_cache else None
+        manifest = CollectionManifest.load(conf, args, cache_key) if collection_cache else None
+        if manifest is not None:
+            index.loader = LazyCollection(session, index, manifest)
+        elif lazy:
+            index.loader = LazyCollection(session, index, SourceFinder(session))
+        else:
+            conf.hook.pytest_collection(session=session)
+            if collection_cache:
+                CollectionManifest.from_session(session, args).save(conf, cache_key)
     except:
         cleanup()
         raise
 
-    return PytestSession(session, conf, cleanup)
+    return PytestSession(session, conf, cleanup, index)
+
+
+def _prepare_config(args, blocked):
+    """
+    Same as config._prepareconfig, but blocked builtin plugins are not even imported.
+    """
+    pluginmanager = config.PytestPluginManager()
+    for name in blocked:
+        pluginmanager.consider_pluginarg('no:' + name)
+    conf = config.Config(pluginmanager)
+    try:
+        for spec in config.default_plugins:
+            pluginmanager.import_plugin(spec)
+        return pluginmanager.hook.pytest_cmdline_parse(pluginmanager=pluginmanager, args=args)
+    except BaseException:
+        conf._ensure_unconfigure()
+        raise
+
+
+class TestIndex:
+    """
+    Lookup tables for collected items (by name, nodeid, module, fixture, marker and keyword).
+
+    It is registered as pytest plugin, so it is rebuilt every time the session (re)collects items.
+    Marker and keyword tables are built lazily on first use.
+    It also caches PytestTest wrappers, so the same item is always wrapped by the same object.
+
+    loader: optional LazyCollection, which collects the items before they are looked up
+    stamps: modification stamps of indexed test modules and conftests (used by PytestSession.refresh)
+    """
+
+    def __init__(self):
+        self.loader = None
+        self.stamps = {}
+        self._items = None
+        self._items_count = 0
+        self.by_name = {}
+        self.by_nodeid = {}
+        self.by_module = {}
+        self.by_fixture = {}
+        self._by_marker = None
+        self._by_keyword = None
+        self._wrappers = {}
+
+    def pytest_collection_finish(self, session):
+        self.build(session.items)
+
+    def build(self, items):
+        """ Rebuild all lookup tables from the list of items (wrappers of remaining items are kept). """
+        self.by_name, self.by_nodeid, self.by_module, self.by_fixture = {}, {}, {}, {}
+        wrappers, self._wrappers = self._wrappers, {}
+        for item in items:
+            if item in wrappers:
+                self._wrappers[item] = wrappers[item]
+        self._items = items
+        self._items_count = 0
+        self.add(items)
+
+    def add(self, items):
+        """ Add items (already appended to the indexed list of items) to the lookup tables. """
+        self._items_count += len(items)
+        self._by_marker = None
+        self._by_keyword = None
+        for item in items:
+            self.by_name.setdefault(item.name, []).append(item)
+            self.by_nodeid[item.nodeid] = item
+            for module in _get_module_keys(item):
+                self.by_module.setdefault(module, []).append(item)
+            for fixture in getattr(item, 'fixturenames', ()):
+                self.by_fixture.setdefault(fixture, []).append(item)
+            module = item.getparent(pytest.Module)
+            if module is not None and str(module.fspath) not in self.stamps:
+                self.stamps[str(module.fspath)] = _get_file_stamp(str(module.fspath))
+        if items:
+            for conftest in items[0].config.pluginmanager._conftest_plugins:
+                self.stamps.setdefault(conftest.__file__, _get_file_stamp(conftest.__file__))
+
+    def ensure(self, items):
+        """ Rebuild the tables, if the items were changed without collection hooks. """
+        if items is not self._items or len(items) != self._items_count:
+            self.build(items)
+
+    @property
+    def by_marker(self):
+        if self._by_marker is None:
+            by_marker = defaultdict(list)
+            for item in self._items or ():
+                for name in {m.name for m in item.iter_markers()}:
+                    by_marker[name].append(item)
+            self._by_marker = dict(by_marker)
+        return self._by_marker
+
+    @property
+    def by_keyword(self):
+        if self._by_keyword is None:
+            by_keyword = defaultdict(list)
+            for item in self._items or ():
+                for keyword in item.keywords:
+                    by_keyword[keyword].append(item)
+            self._by_keyword = dict(by_keyword)
+        return self._by_keyword
+
+    def wrap(self, item, pytestsession):
+        """ Return cached PytestTest for the item. """
+        try:
+            return self._wrappers[item]
+        except KeyError:
+            test = self._wrappers[item] = PytestTest(item, pytestsession)
+            return test
+
+
+def _get_module_keys(item):
+    """ Module name and module nodeid of the item. """
+    module = item.getparent(pytest.Module)
+    if module is None:
+        return ()
+    return {module.nodeid, module.obj.__name__}
+
+
+class LazyCollection:
+    """
+    Collect test modules on demand.
+
+    Session is collected only to the level of files and packages (test modules are not imported).
+    Items of the module are collected when some lookup needs them and inserted to session.items at the position
+    of their module, so session.items keeps the collection order.
+    pytest_collection_modifyitems is called for each loaded batch of items separately (plugins reordering
+    items see only the new items, items of different modules are never reordered).
+
+    finder: object with method `find(table, key, collectors)` returning paths of modules, which can contain
+        items for this lookup (None means all modules)
+    """
+
+    def __init__(self, session, index, finder):
+        self.session = session
+        self.index = index
+        self.finder = finder
+        self.collectors = session._perform_collect(None, genitems=False)
+        self.loaded = set()
+        self._positions = {}
+
+    def load(self, table=None, key=None):
+        """ Collect all modules needed for lookup in table by the key. """
+        paths = self.finder.find(table, key, self.collectors) if table and key is not None else None
+        collectors = [
+            c for c in self.collectors
+            if c not in self.loaded and (paths is None or any(_contains_path(c, p) for p in paths))
+        ]
+        if not collectors:
+            return
+
+        items = []
+        for collector in collectors:
+            self.loaded.add(collector)
+            position = self.collectors.index(collector)
+            for item in self.session.genitems(collector):
+                self._positions[item] = position
+                items.append(item)
+        config = self.session.config
+        config.hook.pytest_collection_modifyitems(session=self.session, config=config, items=items)
+        self.index.ensure(self.session.items)
+        session_items = self.session.items
+        last = self._get_position(session_items[-1]) if session_items else -1
+        if not items or last <= min(map(self._get_position, items)):
+            session_items.extend(items)
+            self.index.add(items)
+        else:
+            # sort is stable, order of items of one module is kept
+            session_items[:] = sorted(session_items + items, key=self._get_position)
+            self.index.build(session_items)
+
+    def _get_position(self, item):
+        """ Index of the collector of the item (also for items recollected by refresh). """
+        try:
+            return self._positions[item]
+        except KeyError:
+            module = item.getparent(pytest.Module)
+            path = str(module.fspath) if module else str(item.fspath)
+            return next((i for i, c in enumerate(self.collectors) if _contains_path(c, path)), len(self.collectors))
+
+    @property
+    def complete(self):
+        return len(self.loaded) == len(self.collectors)
+
+
+def _contains_path(collector, path):
+    if isinstance(collector, pytest.Package):
+        return path.startswith(str(collector.fspath.dirpath()) + os.sep)
+    return str(collector.fspath) == path
+
+
+class CollectionManifest:
+    """
+    Collected items stored in the pytest cache (see get_session(collection_cache=True)).
+
+    Manifest holds for each item its nodeid, name, module, fixture closure and markers, and locations of used fixture
+    definitions. It is valid only for the same args, ini file and plugins and only if no file (test module, conftest,
+    fixture module or directory containing tests) was changed since it was stored.
+    """
+    CACHE_KEY = 'ifixture/collection/'
+
+    def __init__(self, args, files, items, fixturedefs):
+        self.args = args
+        self.files = files
+        self.items = items
+        self.fixturedefs = fixturedefs
+        self._tables = None
+
+    @classmethod
+    def get_cache_key(cls, config, args):
+        """
+        Cache key for the args, ini file (path and stamp) and names of registered plugins.
+        It has to be computed before collection (plugins registered while collecting would change it),
+        conftests are not included (they are checked by is_valid).
+        """
+        pluginmanager = config.pluginmanager
+        plugins = sorted(
+            name for name, plugin in pluginmanager.list_name_plugin()
+            if plugin is not None and plugin not in pluginmanager._conftest_plugins and not name.isdigit()
+        )
+        inifile = str(config.inifile) if config.inifile else None
+        key = json.dumps([
+            str(config.invocation_dir), list(args), inifile, inifile and _get_file_stamp(inifile), plugins
+        ])
+        return cls.CACHE_KEY + hashlib.sha1(key.encode()).hexdigest()
+
+    @classmethod
+    def load(cls, config, args, key=None):
+        """
+        Load manifest for these args. Return None, if there is no valid manifest.
+
+        :param key: (default get_cache_key) cache key of the manifest
+        """
+        cache = getattr(config, 'cache', None)
+        if cache is None:
+            return None
+        data = cache.get(key or cls.get_cache_key(config, args), None)
+        if not data or data.get('args') != list(args):
+            return None
+        manifest = cls(data['args'], data['files'], data['items'], data['fixturedefs'])
+        return manifest if manifest.is_valid() else None
+
+    def save(self, config, key=None):
+        cache = getattr(config, 'cache', None)
+        if cache is not None:
+            cache.set(key or self.get_cache_key(config, self.args), {
+                'args': self.args,
+                'files': self.files,
+                'items': self.items,
+                'fixturedefs': self.fixturedefs,
+            })
+
+    @classmethod
+    def from_session(cls, session, args):
+        rootdir = str(session.config.rootdir)
+        paths = {str(m.__file__) for m in session.config.pluginmanager._conftest_plugins}
+        items, fixturedefs = [], {}
+        for item in session.items:
+            module = item.getparent(pytest.Module)
+            module_path = str(module.fspath) if module else str(item.fspath)
+            paths.add(module_path)
+            markers = sorted({m.name for m in item.iter_markers()})
+            items.append([item.nodeid, item.name, module_path, sorted(_get_module_keys(item)),
+                          list(getattr(item, 'fixturenames', ())), markers])
+
+            fixtureinfo = getattr(item, '_fixtureinfo', None)
+            for name, defs in (fixtureinfo.name2fixturedefs.items() if fixtureinfo else ()):
+                locations = fixturedefs.setdefault(name, [])
+                for fd in defs:
+                    location = source_index.location(fd.func, rootdir)
+                    if location not in locations:
+                        locations.append(location)
+                    path = inspect.getfile(compat.get_real_func(fd.func))
+                    if path.startswith(rootdir):
+                        paths.add(path)
+
+        for path in list(paths):
+            directory = os.path.dirname(path)
+            while directory.startswith(rootdir) and directory not in paths:
+                paths.add(directory)
+                directory = os.path.dirname(directory)
+
+        return cls(list(args), {p: _get_file_stamp(p) for p in sorted(paths)}, items, fixturedefs)
+
+    def is_valid(self):
+        return all(_get_file_stamp(path) == stamp for path, stamp in self.files.items())
+
+    def find(self, table, key, collectors=None):
+        """ Return paths of modules containing items for the lookup (None if manifest can't tell). """
+        if self._tables is None:
+            tables = {t: {} for t in ('by_name', 'by_nodeid', 'by_module', 'by_fixture', 'by_marker')}
+            for nodeid, name, path, modules, fixtures, markers in self.items:
+                for t, keys in (('by_name', [name]), ('by_nodeid', [nodeid]), ('by_module', modules),
+                                ('by_fixture', fixtures), ('by_marker', markers)):
+                    for k in keys:
+                        tables[t].setdefault(k, set()).add(path)
+            self._tables = tables
+        if table not in self._tables:
+            return None
+        return self._tables[table].get(key, set())
+
+
+class SourceFinder:
+    """
+    Find test modules for lookups without importing them (used by lazy sessions).
+
+    Modules are searched by their source code (test name or names of fixtures depending on the fixture),
+    so it can find more modules than needed (items are looked up after the collection).
+    Tests using fixture only through `request.getfixturevalue` are not found.
+    Lookups by marker and keyword need all modules.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._sources = {}
+
+    def find(self, table, key, collectors):
+        rootdir = self.session.config.rootdir
+        paths = self._get_paths(collectors)
+        if table == 'by_nodeid':
+            return {str(rootdir.join(key.split('::')[0]))}
+        if table == 'by_module':
+            suffix = key if key.endswith('.py') else key.replace('.', os.sep) + '.py'
+            return {p for p in paths if p.endswith(os.sep + suffix)}
+        if table == 'by_name':
+            return self._search(paths, {key.split('[')[0]})
+        if table == 'by_fixture':
+            names = self._get_dependent_fixtures(key)
+            if names is None:
+                return None
+            return self._search(paths, names)
+        return None
+
+    def _get_paths(self, collectors):
+        paths = []
+        for collector in collectors:
+            if isinstance(collector, pytest.Package):
+                paths.extend(str(p) for p in collector.fspath.dirpath().visit('*.py'))
+            else:
+                paths.append(str(collector.fspath))
+        return paths
+
+    def _get_dependent_fixtures(self, fixture):
+        """ Fixture and all known fixtures depending on it (None if some autouse fixture depends on it). """
+        fixturemanager = self.session._fixturemanager
+        dependents = {}
+        for name, fixturedefs in fixturemanager._arg2fixturedefs.items():
+            for fd in fixturedefs:
+                for argname in fd.argnames:
+                    dependents.setdefault(argname, set()).add(name)
+
+        names, stack = {fixture}, [fixture]
+        while stack:
+            for name in dependents.get(stack.pop(), ()):
+                if name not in names:
+                    names.add(name)
+                    stack.append(name)
+
+        autouse = {name for _, autousenames in fixturemanager._nodeid_and_autousenames for name in autousenames}
+        return None if names & autouse else names
+
+    def _search(self, paths, words):
+        pattern = re.compile(r'\b(%s)\b' % '|'.join(map(re.escape, sorted(words))))
+        return {p for p in paths if pattern.search(self._get_source(p))}
+
+    def _get_source(self, path):
+        if path not in self._sources:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    self._sources[path] = f.read()
+            except OSError:
+                self._sources[path] = ''
+        return self._sources[path]
+
+
+def _get_file_stamp(path):
+    """ Modification time and size of the file (None if the file does not exist). """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class SourceEntry(namedtuple('SourceEntry', 'path, lineno, source')):
+    """
+    path: absolute path of the file with function
+    lineno: first line number of the function code object
+    source: source code of the function (None until it is needed) or OSError if it can't be found
+    """
+    __slots__ = ()
+
+
+class SourceIndex:
+    """
+    Cache of locations and source codes of functions (fixtures, tests) used for printing.
+
+    Entries are keyed by code object, so every function is resolved only once. All entries of a file
+    are dropped when modification stamp of the file changes (also the code objects of reloaded modules).
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, func, with_source=False):
+        func = compat.get_real_func(func)
+        code = func.__code__
+        path = code.co_filename
+        stamp = _get_file_stamp(path)
+        with self._lock:
+            file = self._files.get(path)
+            if file is None or file[0] != stamp:
+                file = self._files[path] = (stamp, {})
+            entry = file[1].get(code)
+            if entry is None:
+                entry = file[1][code] = SourceEntry(os.path.abspath(inspect.getfile(func)), code.co_firstlineno, None)
+        if with_source and entry.source is None:
+            try:
+                source = inspect.getsource(func)
+            except OSError as e:
+                source = e
+            entry = entry._replace(source=source)
+            with self._lock:
+                file[1][code] = entry
+        return entry
+
+    def location(self, func, curdir=None):
+        """
+        Location 'path:line' of the function (same as _pytest.compat.getlocation).
+
+        :param func: function (decorated fixture functions are unwrapped)
+        :param curdir: (default current working directory) path is relative to this directory if it is inside it
+        """
+        entry = self._get_entry(func)
+        path = entry.path
+        curdir = str(curdir or os.getcwd()).rstrip(os.sep) + os.sep
+        if path.startswith(curdir):
+            path = path[len(curdir):]
+        return f'{path}:{entry.lineno + 1}'
+
+    def source(self, func):
+        """ Source code of the function, raise OSError if it can't be found (same as inspect.getsource). """
+        source = self._get_entry(func, with_source=True).source
+        if isinstance(source, OSError):
+            raise source
+        return source
 
+    def clear(self):
+        with self._lock:
+            self._files.clear()
 
-class PytestSession(namedtuple('PytestSession', 'session, config, cleanup_session')):
+
+source_index = SourceIndex()
+
+
+class PytestSession(namedtuple('PytestSession', 'session, config, cleanup_session, index')):
     """
     This hold pytest session and provide some api for it.
 
@@ -68,53 +621,637 @@ class PytestSession(namedtuple('PytestSession', 'session, config, cleanup_sessio
 
     session: pytest session
     config: pytest config for this session
-    cleanup_session: teardown fixtures, cleanup session and config
+    cleanup_session: SessionCleanup, teardown fixtures, cleanup session and config (see close)
+    index: TestIndex with lookup tables for collected items
     """
     __slots__ = ()
 
+    def close(self):
+        """
+        Teardown fixtures, cleanup session and config and release collected items, fixture definitions and plugins
+        (the session can't be used anymore). It can be called repeatedly.
+        """
+        self.cleanup_session()
+        release_session(self.config, self.session)
+        self.index.__init__()
+
+    @property
+    def closed(self):
+        return self.cleanup_session.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     @property
     def tests(self):
         """ List of all tests in this session. """
-        return [PytestTest(t, self) for t in self.session.items]
+        self._lookup('by_nodeid')
+        return self._wrap(self.session.items)
 
-    @property
-    def config(self):
-        return self.config.options
+    def _lookup(self, table, key=None):
+        if self.index.loader is not None:
+            self.index.loader.load(table, key)
+        self.index.ensure(self.session.items)
+        return getattr(self.index, table)
+
+    def _wrap(self, items):
+        self.index.ensure(self.session.items)
+        return [self.index.wrap(t, self) for t in items]
+
+    def get_test_by_name(self, test, share_fixtures=False):
+        """
+        Retrieve test by name.
+
+        :param test: name of the test
+        :param share_fixtures: (default False) if active test is other parametrized variant of the same test,
+            keep its resolved fixtures which do not depend on differing params, reset the others and make this test
+            active (otherwise other active test raises ValueError)
+        """
+        return self._get_usable_test(self._find_item(test), share_fixtures)
 
-    def get_test_by_name(self, test):
-        """ Retrieve test by name."""
+    def _find_item(self, test):
+        if isinstance(test, PytestTest):
+            return test.test
         try:
-            test = [t for t in self.session.items if t.name == test][0]
-        except IndexError:
+            if '::' in test:
+                return self._lookup('by_nodeid', test)[test]
+            return self._lookup('by_name', test)[test][0]
+        except KeyError:
             raise ValueError(f"Test '{test}' does not exists.")
-        if self.active_test and self.active_test != test:
-            raise ValueError(f"You can't use test {test.name}, because you did not finalize currently active test.")
-        return PytestTest(test, self)
+
+    def get_test_by_nodeid(self, nodeid, share_fixtures=False):
+        """ Retrieve test by nodeid (e.g. 'tests/test_articles.py::test_articles'), see get_test_by_name. """
+        try:
+            test = self._lookup('by_nodeid', nodeid)[nodeid]
+        except KeyError:
+            raise ValueError(f"Test '{nodeid}' does not exists.")
+        return self._get_usable_test(test, share_fixtures)
+
+    def _get_usable_test(self, test, share_fixtures=False):
+        active_test = self.active_test
+        if active_test and active_test.test is not test:
+            if share_fixtures and _is_variant(active_test.test, test):
+                self._move_fixtures(active_test, test)
+            else:
+                raise ValueError(
+                    f"You can't use test {test.name}, because you did not finalize currently active test.")
+        return self.index.wrap(test, self)
+
+    def _move_fixtures(self, active_test, item):
+        """ Move resolved fixtures of active test to its parametrized variant (item), which do not depend on params. """
+        old_callspec, new_callspec = active_test.test.callspec, item.callspec
+        differing = {
+            name for name in {*old_callspec.indices, *new_callspec.indices}
+            if old_callspec.indices.get(name) != new_callspec.indices.get(name)
+        }
+        for name in differing:
+            if name in active_test.request._fixture_defs:
+                active_test.reset_fixture(name)
+
+        old_request, new_request = active_test.request, item._request
+        for name in old_request._fixture_defs:
+            if old_request._arg2fixturedefs.get(name) is not new_request._arg2fixturedefs.get(name):
+                new_request._arg2fixturedefs[name] = old_request._arg2fixturedefs[name]
+        new_request._fixture_defs, old_request._fixture_defs = old_request._fixture_defs, {}
+        new_request._arg2index, old_request._arg2index = old_request._arg2index, {}
+
+        setupstate = self.session._setupstate
+        finalizers = setupstate._finalizers.pop(active_test.test, [])
+        for index, finalizer in enumerate(finalizers):
+            if isinstance(finalizer, functools.partial) and 'request' in finalizer.keywords:
+                finalizers[index] = functools.partial(
+                    finalizer.func, *finalizer.args, **{**finalizer.keywords, 'request': new_request}
+                )
+        if finalizers:
+            setupstate._finalizers.setdefault(item, []).extend(finalizers)
+
+        edges = self.config.pluginmanager.get_plugin('ifixture-graph').edges
+        if active_test.test in edges:
+            edges.setdefault(item, set()).update(edges.pop(active_test.test))
+        self.state.switch(item)
 
     def get_tests_for_fixture(self, fixture):
         """ Get all tests using fixture with this name. """
-        tests = []
-        for test in self.session.items:
-            if fixture in test.fixturenames:
-                tests.append(test)
-        return [PytestTest(t, self) for t in tests]
+        return self._wrap(self._lookup('by_fixture', fixture).get(fixture, ()))
+
+    def get_tests_for_module(self, module):
+        """ Get all tests from module (module name or module nodeid). """
+        return self._wrap(self._lookup('by_module', module).get(module, ()))
+
+    def get_tests_for_marker(self, marker):
+        """ Get all tests marked with this marker. """
+        return self._wrap(self._lookup('by_marker', marker).get(marker, ()))
+
+    def get_tests_for_keyword(self, keyword):
+        """ Get all tests with this keyword (same keywords as used by -k option). """
+        return self._wrap(self._lookup('by_keyword', keyword).get(keyword, ()))
 
     @property
     def active_test(self):
         """ Return active test (test with at least resolved fixture). Return None if there is no active test."""
-        finalizers = self.session._setupstate._finalizers
-        if finalizers:
-            return PytestTest(list(finalizers.values())[0][0].keywords['request']._pyfuncitem, self)
+        state = self.state
+        test = state.test if state.enabled else _get_active_item(self.session._setupstate)
+        if test is not None:
+            return self.index.wrap(test, self)
+
+    @property
+    def state(self):
+        """ SessionState tracking the active test. """
+        return self.config.pluginmanager.get_plugin('ifixture-state')
+
+    def track_state(self, enabled=True):
+        """
+        Start (or stop) tracking the active test incrementally from fixture setups and teardowns, so active_test
+        (and can_be_used, getfixturevalue, ...) does not scan finalizers of the setup state.
+        Tracking is started by subscribe too.
+
+        :param enabled: (default True) start or stop tracking
+        """
+        if enabled:
+            self.state.start(self.session._setupstate)
+        else:
+            self.state.stop()
+
+    def subscribe(self, callback):
+        """
+        Call callback with StateEvent on every change of the session state (fixture setup, teardown, reset,
+        override and switch of the active test). It starts tracking of the state (see track_state).
+
+        :param callback: callable with one argument (StateEvent), it is called in the thread making the change
+        :return: callback (it can be used as decorator)
+        """
+        if not self.state.enabled:
+            self.track_state()
+        self.state.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """ Stop calling callback registered by subscribe. """
+        self.state.subscribers.remove(callback)
 
     def teardown(self):
         """ Teardown whole session."""
-        self.session._setupstate.teardown_all()
+        try:
+            self.wait_teardowns()
+        finally:
+            teardown_all(self.session._setupstate)
+        self.config.pluginmanager.get_plugin('ifixture-memory').check_leaks()
+
+    def defer_teardowns(self, enabled=True):
+        """
+        Run finalizers of teardown, reset_fixture and switch_to on background thread (or stop it).
+
+        Finished fixtures are detached from the test at once, so the next test can be used immediately.
+        Finalizers are called one job after another in order of the calls, errors are raised by wait_teardowns.
+        Setup of a fixture waits for pending teardowns of the same fixture definition, so resources released
+        by the finalizers are released before it is set up again (workers and snapshots wait for all teardowns).
+
+        :param enabled: (default True) start or stop deferring teardowns (stopping waits for pending teardowns)
+        """
+        self.config.pluginmanager.get_plugin('ifixture-teardowns').enabled = enabled
+        if not enabled:
+            self.wait_teardowns()
+
+    def wait_teardowns(self):
+        """ Wait until all deferred teardowns are finished (see defer_teardowns), raise the first error of them. """
+        teardowns = self.config.pluginmanager.get_plugin('ifixture-teardowns')
+        teardowns.wait()
+        teardowns.raise_errors()
+
+    def switch_to(self, test):
+        """
+        Make other test active, keep resolved fixtures which it shares with currently active test.
+
+        Only fixtures of nodes (package, module, class, test function), which are not in the collection chain
+        of the new test, are teardowned. Session scoped fixtures (and e.g. module scoped fixtures of test from
+        the same module) stay resolved and are used by the new test.
+
+        :param test: PytestTest or name of the test
+        :return: PytestTest
+        """
+        item = self._find_item(test)
+        active_test = self.active_test
+        if active_test is None or active_test.test is item:
+            return self.index.wrap(item, self)
+
+        setupstate = self.session._setupstate
+        needed_collectors = item.listchain()
+        teardowns = self.config.pluginmanager.get_plugin('ifixture-teardowns')
+        exceptions = []
+        if teardowns.enabled:
+            teardowns.detach(self, [c for c in setupstate._finalizers if c not in needed_collectors])
+        for colitem in _get_teardown_order(setupstate):
+            if colitem not in needed_collectors:
+                try:
+                    setupstate._callfinalizers(colitem)
+                except Exception:
+                    exceptions.append((colitem.nodeid, sys.exc_info()))
+
+        active_test.request._arg2index = {}
+        active_test.request._fixture_defs = {}
+
+        for finalizers in setupstate._finalizers.values():
+            # finish of higher scoped fixture is scheduled again by every test requesting it, keep the first one
+            seen = set()
+            rewritten = []
+            for finalizer in finalizers:
+                if isinstance(finalizer, functools.partial) and 'request' in finalizer.keywords:
+                    if finalizer.func in seen:
+                        continue
+                    seen.add(finalizer.func)
+                    finalizer = functools.partial(
+                        finalizer.func, *finalizer.args, **{**finalizer.keywords, 'request': item._request}
+                    )
+                rewritten.append(finalizer)
+            finalizers[:] = rewritten
+        self.state.switch(item)
+        _print_teardown_errors(exceptions)
+
+        return self.index.wrap(item, self)
+
+    def track_timings(self, enabled=True):
+        """
+        Start (or stop) recording durations of fixture setups and teardowns
+        (see fixture_stats, export_trace and PytestTest.fixture_timings).
+
+        :param enabled: (default True) start or stop recording
+        """
+        self.config.pluginmanager.get_plugin('ifixture-timings').enabled = enabled
+
+    @property
+    def fixture_stats(self):
+        """
+        Aggregated timings of fixture setups and teardowns recorded by track_timings.
+
+        :return: dict with (fixture name, phase) mapped to FixtureStats
+        """
+        return self.config.pluginmanager.get_plugin('ifixture-timings').get_stats()
+
+    def export_trace(self, path):
+        """ Save timings recorded by track_timings as Chrome trace events JSON (chrome://tracing, Perfetto). """
+        self.config.pluginmanager.get_plugin('ifixture-timings').export_trace(path)
+
+    def track_memory(self, enabled=True, top=5):
+        """
+        Start (or stop) tracemalloc accounting of fixture setups and checks of fixture values alive after teardown
+        (see memory_report). Tracing slows down the setups noticeably, use it only when looking for memory issues.
+
+        :param enabled: (default True) start or stop tracking
+        :param top: (default 5) number of the biggest allocation sites kept for every setup
+        """
+        memory = self.config.pluginmanager.get_plugin('ifixture-memory')
+        if enabled:
+            memory.start(top)
+        else:
+            memory.stop()
+
+    @property
+    def memory_report(self):
+        """ MemoryReport of all fixture setups and leaked fixture values recorded by track_memory. """
+        return self.config.pluginmanager.get_plugin('ifixture-memory').get_report()
+
+    @property
+    def fixture_cache(self):
+        """ Persistent cache of fixture values (see cache_fixture). """
+        return self.config.pluginmanager.get_plugin('ifixture-cache')
+
+    @property
+    def snapshots(self):
+        """ Snapshots manager of this session (see PytestTest.snapshot). """
+        return self.config.pluginmanager.get_plugin('ifixture-snapshots')
+
+    def restore(self, snapshot):
+        """
+        Continue in fresh fork of the snapshot (see PytestTest.snapshot).
+        Wait until the restored process finishes, this process stays untouched.
+
+        :return: exit code of the restored process
+        """
+        return self.snapshots.restore(snapshot)
+
+    def map_tests(self, func, tests=None, workers=None, chunksize=None):
+        """
+        Call func with resolved fixtures of each test in pool of worker processes.
+
+        Workers are forked from this process, so they use already collected session. Each worker resolves fixture
+        closure of its tests one by one and switches between them by switch_to (tests are split to the workers by
+        chunks in order of collection, so tests from the same module share module and session scoped fixtures).
+        Fixtures of the next test are not resolved in advance, setups overlap only between the workers.
+        Workers are teardowned when the iterator is exhausted. There can't be active test in this session.
+        (Not available on platforms without os.fork.)
+
+        :param func: callable called with dict of fixture values of the test in the worker, result has to be picklable
+        :param tests: list of tests (PytestTest, name or nodeid), all tests by default
+        :param workers: number of worker processes (default os.cpu_count())
+        :param chunksize: number of tests sent to the worker at once
+        :return: iterator of WorkerResult in order of completion
+        """
+        nodeids = [self._find_item(t).nodeid for t in tests] if tests is not None else [
+            t.test.nodeid for t in self.tests
+        ]
+        return _map_in_workers(self, func, nodeids, *self._get_pool_size(len(nodeids), workers, chunksize))
+
+    def _get_pool_size(self, count, workers, chunksize):
+        if self.active_test is not None:
+            raise ValueError("Can't start workers, teardown active test first.")
+        self.wait_teardowns()
+        workers = workers or os.cpu_count() or 1
+        return workers, chunksize or max(1, count // (workers * 4))
+
+    def check_fixtures(self, tests=None, workers=None, chunksize=None):
+        """
+        Check that fixture closures of the tests can be set up, tests are checked in pool of worker processes
+        (see map_tests, workers keep shared higher scoped fixtures while switching between tests).
+
+        Tests with identical fixture closure (same fixture definitions and params) are checked only once,
+        other tests with the same closure get its result. Test bodies are not run.
+
+        :param tests: list of tests (PytestTest, name or nodeid), all tests by default
+        :param workers: number of worker processes (default os.cpu_count())
+        :param chunksize: number of tests sent to the worker at once
+        :return: FixtureCheckReport
+        """
+        start = time.perf_counter()
+        items = [self._find_item(t) for t in tests] if tests is not None else [t.test for t in self.tests]
+        checked = {}
+        for item in items:
+            checked.setdefault(_get_closure_key(item), item.nodeid)
+        nodeids = list(checked.values())
+        workers, chunksize = self._get_pool_size(len(nodeids), workers, chunksize)
+        results = {
+            r.nodeid: r for r in _map_in_workers(self, None, nodeids, workers, chunksize, runner=_check_in_worker)
+        }
+        report = []
+        for item in items:
+            result = results[checked[_get_closure_key(item)]]
+            if result.nodeid != item.nodeid:
+                result = result._replace(nodeid=item.nodeid, setup=None, fixtures={}, same_as=result.nodeid)
+            report.append(result)
+        return FixtureCheckReport(report, time.perf_counter() - start, workers)
+
+    def changed_files(self):
+        """ List of collected test modules and conftests changed since they were collected. """
+        return [path for path, stamp in self.index.stamps.items() if _get_file_stamp(path) != stamp]
+
+    def refresh(self):
+        """
+        Recollect test modules, which were changed (or which are affected by changed conftest) since collection.
+
+        Changed conftests are reimported and their fixtures replaced in fixture manager.
+        Items of affected modules are replaced in session.items (order is kept), other items stay untouched.
+        If active test is affected, it is teardowned first, otherwise all resolved fixtures stay alive.
+        New test files are not detected, use new session for them.
+
+        :return: list of changed files
+        """
+        changed = self.changed_files()
+        if not changed:
+            return changed
+
+        pm = self.config.pluginmanager
+        conftests = [m for m in pm._conftest_plugins if m.__file__ in changed]
+        conftest_dirs = tuple(os.path.dirname(m.__file__) + os.sep for m in conftests)
+
+        modules = []
+        for item in self.session.items:
+            module = item.getparent(pytest.Module)
+            path = str(module.fspath) if module else None
+            if module not in modules and (path in changed or (path and path.startswith(conftest_dirs))):
+                modules.append(module)
+
+        active_test = self.active_test
+        if active_test and active_test.test.getparent(pytest.Module) in modules:
+            active_test.teardown()
+
+        fixturemanager = self.session._fixturemanager
+        for conftest in conftests:
+            _reload_conftest(pm, fixturemanager, conftest)
+
+        new_items = {}
+        for module in modules:
+            new_items[module] = _recollect_module(self.session, module)
+
+        items = []
+        for item in self.session.items:
+            module = item.getparent(pytest.Module)
+            if module in new_items:
+                items.extend(new_items.pop(module))
+            elif module not in modules:
+                items.append(item)
+        self.session.items[:] = items
+
+        for path in changed:
+            self.index.stamps[path] = _get_file_stamp(path)
+        self.index.build(self.session.items)
+        return changed
+
+    def reload_fixtures(self):
+        """
+        Reload changed functions (fixtures and tests) of changed test modules and conftests in place.
+
+        Code of changed functions is replaced (function objects and FixtureDefs stay the same). Resolved fixtures
+        with changed code are reset together with fixtures depending on them (see PytestTest.reset_fixture),
+        all other resolved fixtures stay untouched.
+        Only changes of function bodies are reloaded. Files with other changes (new or removed functions, changed
+        arguments or decorators, module level code) and files without resolved fixtures are left for refresh.
+        Sources of the files are kept only while track_sources is enabled (files of fixtures resolved since then).
+
+        :return: list of names of reset fixtures (changed fixtures and fixtures depending on them)
+        """
+        sources = self.config.pluginmanager.get_plugin('ifixture-sources')
+        if not sources.enabled:
+            raise ValueError("Can't reload fixtures, sources are not tracked (call track_sources first).")
+        modules = {m.__file__: m for m in self.config.pluginmanager._conftest_plugins}
+        for item in self.session.items:
+            module = item.getparent(pytest.Module)
+            if module is not None:
+                modules.setdefault(str(module.fspath), module.obj)
+
+        changed = set()
+        for path in self.changed_files():
+            if path in modules and path in sources.sources:
+                stamp = _get_file_stamp(path)
+                reloaded = sources.reload(modules[path], path, self.config)
+                if reloaded is not None:
+                    changed.update(reloaded)
+                    self.index.stamps[path] = stamp
+
+        active_test = self.active_test
+        if active_test is None or not changed:
+            return []
+        reset = []
+        for name, fixturedef in list(active_test.request._fixture_defs.items()):
+            func = compat.get_real_func(fixturedef.func)
+            if getattr(func, '__func__', func) in changed and name in active_test.request._fixture_defs:
+                reset.extend(f for f in (*active_test.dependents(name), name) if f not in reset)
+                active_test.reset_fixture(name)
+        return reset
+
+    def track_sources(self, enabled=True):
+        """
+        Start (or stop) keeping sources of test modules and conftests with resolved fixtures as they were imported,
+        so their changed functions can be reloaded by reload_fixtures.
+
+        :param enabled: (default True) start or stop keeping sources
+        """
+        sources = self.config.pluginmanager.get_plugin('ifixture-sources')
+        if enabled:
+            sources.start(self.session._setupstate)
+        else:
+            sources.stop()
+
+    def override(self, fixtures, scope=None):
+        """
+        Override fixtures for all tests of the session (also for tests collected later).
+
+        One FixtureDef is created for every fixture and it is registered in fixture manager, so it is used instead
+        of all other definitions of the fixture. Use returned Override to revert it:
+            [1] with session.override({'db_name': 'test-db'}):
+            [2]     session.get_test_by_name('test_db').getfixturevalue('db')
+
+        :param fixtures: dict with fixture names mapped to values (fixtures, callables or other values, see setfixture)
+        :param scope: scope of the fixtures, default is scope of decorated fixture or scope of the overridden fixture
+            ('function' for new fixtures)
+        :return: Override
+        """
+        fixturemanager = self.session._fixturemanager
+        active_test = self.active_test
+        resolved = [f for f in fixtures if active_test and f in active_test.request._fixture_defs]
+        if resolved:
+            raise ValueError(f"Fixture is already resolved by active test: {', '.join(resolved)}.")
+
+        fixturedefs = []
+        for fixture, value in fixtures.items():
+            overridden = fixturemanager._arg2fixturedefs.get(fixture)
+            default_scope = overridden[-1].scope if overridden else 'function'
+            fixturedefs.append(_make_fixturedef(fixturemanager, fixture, value, scope, default_scope))
+        self.config.pluginmanager.get_plugin('ifixture-overrides').add(fixturedefs, self.session.items)
+        for fixture in fixtures:
+            self.state.emit('override', None, fixture)
+        return Override(self, tuple(fixturedefs))
+
+    def watch(self, interval=1.0, reload_fixtures=False):
+        """
+        Start daemon thread, which polls collected files and calls refresh when some file is changed.
+        Refresh runs in the watcher thread, so do not use the session from other thread while files are changing.
+
+        :param interval: polling interval in seconds
+        :param reload_fixtures: (default False) reload changed functions in place first (see reload_fixtures),
+            so changed fixtures are reset without teardown of the whole active test (it starts track_sources)
+        :return: Watcher (call its stop method to stop watching)
+        """
+        if reload_fixtures:
+            self.track_sources()
+        watcher = Watcher(self, interval, reload_fixtures)
+        watcher.start()
+        return watcher
 
     def __repr__(self):
         return f"<PytestSession {self.tests!r}>"
 
     def __str__(self):
-        return "\n\n".join(map(str, self.tests))
+        return '\n'.join(self.iter_lines())
+
+    def iter_lines(self):
+        """
+        Generate lines of tables of all tests (same as str(session)), so output for large sessions can be paged.
+            [1] from itertools import islice
+            [2] print(*islice(session.iter_lines(), 100), sep='\n')
+        """
+        active_test = self.active_test
+        for i, test in enumerate(self.tests):
+            if i:
+                yield ''
+            yield from test._iter_lines(active_test)
+
+
+def _is_variant(item, other):
+    """ Check if items are parametrized variants of the same test function. """
+    return (
+        hasattr(item, 'callspec') and hasattr(other, 'callspec') and item.parent is other.parent
+        and getattr(item, 'originalname', None) == getattr(other, 'originalname', None) is not None
+    )
+
+
+class Watcher(threading.Thread):
+    """ Thread polling files of the session and refreshing it (see PytestSession.watch). """
+
+    def __init__(self, pytestsession, interval, reload_fixtures=False):
+        super().__init__(name='ifixture-watcher', daemon=True)
+        self.pytestsession = pytestsession
+        self.interval = interval
+        self.reload_fixtures = reload_fixtures
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.reload_fixtures and self.pytestsession.changed_files():
+                    self.pytestsession.reload_fixtures()
+                if self.pytestsession.changed_files():
+                    self.pytestsession.refresh()
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _get_fixture_globals(fixturedef):
+    func = compat.get_real_func(fixturedef.func)
+    func = getattr(func, '__func__', func)
+    return getattr(func, '__globals__', None)
+
+
+def _forget_fixtures(fixturemanager, module, nodeid):
+    """ Remove all FixtureDefs defined in the module from fixture manager. """
+    removed = set()
+    for name, fixturedefs in list(fixturemanager._arg2fixturedefs.items()):
+        kept = [fd for fd in fixturedefs if _get_fixture_globals(fd) is not module.__dict__]
+        if len(kept) != len(fixturedefs):
+            removed.add(name)
+            fixturemanager._arg2fixturedefs[name] = kept
+    fixturemanager._nodeid_and_autousenames[:] = [
+        (baseid, names) for baseid, names in fixturemanager._nodeid_and_autousenames
+        if not (baseid == (nodeid or '') and set(names) <= removed)
+    ]
+    fixturemanager._holderobjseen.discard(module)
+
+
+def _reload_conftest(pluginmanager, fixturemanager, conftest):
+    """ Import changed conftest again and replace the old one (plugin and its fixtures). """
+    path = py.path.local(conftest.__file__).realpath()
+    nodeid = path.dirpath().relto(fixturemanager.config.rootdir).replace(path.sep, '/')
+    positions = [(mods, mods.index(conftest)) for mods in pluginmanager._dirpath2confmods.values() if conftest in mods]
+
+    pluginmanager.unregister(conftest)
+    pluginmanager._conftest_plugins.discard(conftest)
+    pluginmanager._conftestpath2mod.pop(path, None)
+    _forget_fixtures(fixturemanager, conftest, nodeid)
+    sys.modules.pop(conftest.__name__, None)
+
+    new_conftest = pluginmanager._importconftest(path)
+    for mods, position in positions:
+        mods[:] = [m for m in mods if m is not new_conftest and m is not conftest]
+        mods.insert(position, new_conftest)
+
+
+def _recollect_module(session, module):
+    """ Import test module again and return its new items. """
+    _forget_fixtures(session._fixturemanager, module.obj, module.nodeid)
+    sys.modules.pop(module.obj.__name__, None)
+
+    parent = module.parent if isinstance(module.parent, (pytest_main.Session, pytest.Package)) else session
+    items = []
+    if not module.fspath.isfile():
+        return items
+    for node in parent._collectfile(module.fspath, handle_dupes=False):
+        items.extend(session.genitems(node))
+    session.config.hook.pytest_collection_modifyitems(session=session, config=session.config, items=items)
+    return items
 
 
 class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
@@ -137,6 +1274,17 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
 
         return fixture_values
 
+    @property
+    def fixture_timings(self):
+        """ List of FixtureTiming for setups and teardowns of fixtures of this test (see track_timings). """
+        timings = self.session.config.pluginmanager.get_plugin('ifixture-timings').timings
+        return [t for t in list(timings) if t.test == self.test.nodeid]
+
+    @property
+    def memory_report(self):
+        """ MemoryReport of fixture setups and leaked fixture values of this test (see PytestSession.track_memory). """
+        return self.session.config.pluginmanager.get_plugin('ifixture-memory').get_report(self.test.nodeid)
+
     @property
     def fixtures_unresolved(self):
         """ List of unresolved fixtures. """
@@ -175,7 +1323,16 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
         """
         self.request._arg2index = {}
         self.request._fixture_defs = {}
-        self.session._setupstate.teardown_all()
+        plugins = self.session.config.pluginmanager
+        plugins.get_plugin('ifixture-graph').edges.pop(self.test, None)
+        teardowns = plugins.get_plugin('ifixture-teardowns')
+        if teardowns.enabled:
+            teardowns.detach(self.pytestsession, list(self.session._setupstate._finalizers))
+        else:
+            try:
+                teardown_all(self.session._setupstate)
+            finally:
+                plugins.get_plugin('ifixture-memory').check_leaks()
         if remove_custom_fixtures:
             self.request._arg2fixturedefs = self.test._fixtureinfo.name2fixturedefs.copy()
 
@@ -183,40 +1340,84 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
         """
         Reset only specific fixture (and all fixtures depending on it).
 
+        Fixtures are finalized in reverse topological order of the fixture graph (see fixture_graph),
+        other resolved fixtures stay untouched.
+
         :param fixture: name of the fixture
         :return:
         """
-        fixture_cleanups = self.session._setupstate._finalizers[self.test]
+        if fixture not in self.request._fixture_defs:
+            raise KeyError(f"Can't find {fixture} in {list(self.request._fixture_defs)}")
+
+        fixture_names = [*self.dependents(fixture), fixture]
+        setupstate = self.session._setupstate
+        fixture_cleanups = []
+        for name in fixture_names:
+            for colitem, finalizers in setupstate._finalizers.items():
+                for finish in reversed(finalizers):
+                    if _get_finalizer_fixture_name(finish) == name:
+                        fixture_cleanups.append((name, colitem, finish))
+
+        for name, colitem, finish in fixture_cleanups:
+            setupstate._finalizers[colitem].remove(finish)
+            self.request._arg2index.pop(name, None)
+            self.request._fixture_defs.pop(name, None)
+        for colitem in [c for c, finalizers in setupstate._finalizers.items() if not finalizers]:
+            del setupstate._finalizers[colitem]
+
+        plugins = self.session.config.pluginmanager
+        finalizers = [(name, finish) for name, _, finish in fixture_cleanups]
+        job = functools.partial(_finish_fixtures, finalizers, plugins.get_plugin('ifixture-memory'))
+        teardowns = plugins.get_plugin('ifixture-teardowns')
+        if teardowns.enabled:
+            teardowns.submit(self.pytestsession, job, [finish for _, _, finish in fixture_cleanups])
+        else:
+            _print_teardown_errors(job())
+        self.pytestsession.state.emit('reset', self.test, fixture)
 
-        def get_fixture_name_from_cleanup_method(method):
-            try:
-                return method.func.__self__.argname
-            except KeyError:
-                return object()
+    @property
+    def fixture_graph(self):
+        """
+        Dependency graph of resolved fixtures.
+        Dependencies are arguments of the fixtures and fixtures retrieved by `request.getfixturevalue` in fixture
+        setup.
 
-        fixture_names = list(map(get_fixture_name_from_cleanup_method, fixture_cleanups))
+        :return: dict with resolved fixtures mapped to sets of resolved fixtures they depend on
+        """
+        fixture_defs = self.request._fixture_defs
+        graph = {
+            name: {a for a in fd.argnames if a != name and a in fixture_defs}
+            for name, fd in fixture_defs.items()
+        }
+        plugin = self.session.config.pluginmanager.get_plugin('ifixture-graph')
+        for dependent, dependency in plugin.edges.get(self.test, ()):
+            if dependent in graph and dependency in fixture_defs and dependent != dependency:
+                graph[dependent].add(dependency)
+        return graph
+
+    def dependents(self, fixture):
+        """
+        Resolved fixtures depending (directly or transitively) on the fixture.
 
-        try:
-            index = fixture_names.index(fixture)
-        except KeyError:
-            raise KeyError(f"Can't find {fixture} in {fixture_names}")
+        :param fixture: name of the fixture
+        :return: list of fixture names in teardown order (fixture is always before fixtures it depends on)
+        """
+        graph = self.fixture_graph
+        reverse_graph = defaultdict(set)
+        for name, dependencies in graph.items():
+            for dependency in dependencies:
+                reverse_graph[dependency].add(name)
 
-        fixture_cleanups = list(zip(fixture_names[index:], fixture_cleanups[index:]))
-        exceptions = []
-        while fixture_cleanups:
-            name, finish = fixture_cleanups.pop()
-            try:
-                finish()
-            except Exception:
-                exceptions.append((name, sys.exc_info()))
-            finally:
-                self.request._arg2index.pop(name, None)
-                self.request._fixture_defs.pop(name, None)
+        order = []
+
+        def visit(name):
+            for dependent in sorted(reverse_graph[name]):
+                if dependent not in order:
+                    visit(dependent)
+                    order.append(dependent)
 
-        for e in exceptions:
-            name, exc = e
-            print(f"ERROR IN TEARDOWN FIXTURE [{name}]:")
-            traceback.print_exception(*exc)
+        visit(fixture)
+        return order
 
     def getfixturevalue(self, fixture):
         """
@@ -228,30 +1429,172 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
             raise ValueError("Can't get fixture value. Other test is active.")
         return self.request.getfixturevalue(fixture)
 
-    def setfixture(self, fixture, value):
+    def getfixturevalues(self, fixtures, parallel=True, max_workers=None):
         """
-        Add fixture to the test.
-        - It can override some fixture or create new fixture (not even related to this test).
-        - Check if no other test is active.
-        - Check if the fixture is not already resolved.
+        Retrieve values of multiple fixtures for this test.
 
-        :param fixture: name of the fixture
-        :param value:
-            - fixture (method decorated with @pytest.fixture)
-            - callable (function should return fixture value)
-            - any other (will be used as returned value for the fixture)
+        With parallel=True, fixtures are resolved in thread pool along their dependency graph (fixture is set up
+        as soon as all fixtures it depends on are resolved, so independent fixtures are set up at the same time).
+        Finalizers are registered in the same order as if the fixtures were resolved one by one,
+        so teardown and reset_fixture behave the same way.
+        Fixtures resolved in parallel should not call `request.getfixturevalue` for unresolved fixtures.
+
+        If fixture setup throws Exception, other running setups are finished and the first exception is raised
+        (setup is NOT rolled back).
+
+        :param fixtures: list of fixture names
+        :param parallel: (default True) resolve independent fixtures in parallel
+        :param max_workers: max number of threads
+        :return: dict with fixture names mapped to their values
         """
         if not self.can_be_used:
-            raise ValueError("Can't set fixture value. Other test is active.")
-        if fixture in self.request._fixture_defs:
-            raise ValueError("Fixture is already set.")
-        add_fixture_to_test(fixture, value, self.request)
-    
-    def get_fixture_code(self, fixture, all_defs=False):
+            raise ValueError("Can't get fixture value. Other test is active.")
+        if parallel:
+            FixtureResolver(self.request, max_workers).resolve(fixtures)
+        return {f: self.request.getfixturevalue(f) for f in fixtures}
+
+    async def agetfixturevalue(self, fixture, loop=None):
         """
-        Return code of the fixture as a string.
-        Useful in IPython:
-            [1] function_code = test.get_fixture_code('fixture_name')
+        Retrieve fixture value for this test from coroutine (see agetfixturevalues).
+        """
+        return (await self.agetfixturevalues([fixture], loop=loop))[fixture]
+
+    async def agetfixturevalues(self, fixtures, loop=None, max_workers=None):
+        """
+        Retrieve values of multiple fixtures for this test from coroutine.
+
+        Coroutine and async generator fixtures are run on the loop (running loop by default), other fixtures are
+        resolved in threads (as in getfixturevalues), so independent async fixtures are set up concurrently.
+        Fixtures set up on this loop has to be teardowned from the loop by ateardown or areset_fixture.
+        Without the loop (getfixturevalue), async fixtures are run on the loop managed in separate thread.
+
+        :param fixtures: list of fixture names
+        :param loop: event loop for async fixtures
+        :param max_workers: max number of threads
+        :return: dict with fixture names mapped to their values
+        """
+        running_loop = asyncio.get_event_loop()
+        plugin = self.session.config.pluginmanager.get_plugin('ifixture-async')
+        plugin.loop = loop or running_loop
+        try:
+            return await running_loop.run_in_executor(
+                None, functools.partial(self.getfixturevalues, fixtures, max_workers=max_workers)
+            )
+        finally:
+            plugin.loop = None
+
+    async def ateardown(self, remove_custom_fixtures=False):
+        """ Teardown from coroutine (async fixtures are finished on their loop). """
+        await asyncio.get_event_loop().run_in_executor(None, self.teardown, remove_custom_fixtures)
+
+    async def areset_fixture(self, fixture):
+        """ Reset fixture from coroutine (async fixtures are finished on their loop). """
+        await asyncio.get_event_loop().run_in_executor(None, self.reset_fixture, fixture)
+
+    def run(self, repeat=1, warmup=0, reset=True, profile=False):
+        """
+        Call the test function repeatedly with values of its fixtures (unresolved fixtures are resolved first)
+        and measure the calls. Setups and teardowns of fixtures are not measured.
+
+        With reset, function scoped fixtures are reset between the calls (fixtures of other scopes are shared
+        as in pytest run) and finalizers added by the test itself (request.addfinalizer) are called.
+        Exception raised by the test function is propagated.
+        Coroutine test functions are awaited on the loop of async fixtures (see AsyncFixtures), their cpu time
+        is the time of the loop thread.
+
+        :param repeat: (default 1) number of measured calls
+        :param warmup: (default 0) number of calls before the measured ones
+        :param reset: (default True) reset function scoped fixtures between the calls
+        :param profile: (default False) profile measured calls of the test function with cProfile
+        :return: RunStats
+        """
+        if repeat < 1:
+            raise ValueError('At least one measured call is needed.')
+        profiler = cProfile.Profile() if profile else None
+        func = self.test.obj
+        if inspect.iscoroutinefunction(func):
+            plugin = self.session.config.pluginmanager.get_plugin('ifixture-async')
+            loop = plugin.loop or plugin.get_managed_loop()
+        wall, cpu = [], []
+        for number in range(warmup + repeat):
+            if number and reset:
+                self._reset_function_scope()
+            values = self.getfixturevalues(self.test.fixturenames, parallel=False)
+            kwargs = {arg: values[arg] for arg in self.test._fixtureinfo.argnames}
+            measured = number >= warmup
+            call_profiler = profiler if measured else None
+            if inspect.iscoroutinefunction(func):
+                call_wall, call_cpu = plugin.run(loop, _measure_coroutine(func(**kwargs), call_profiler))
+            else:
+                call_wall, call_cpu = _measure_call(func, kwargs, call_profiler)
+            if measured:
+                wall.append(call_wall)
+                cpu.append(call_cpu)
+        return RunStats(self.test.nodeid, wall, cpu, pstats.Stats(profiler) if profiler is not None else None)
+
+    def _reset_function_scope(self):
+        finalizers = self.session._setupstate._finalizers.get(self.test, [])
+        own_finalizers = [f for f in finalizers if _get_finalizer_fixture_name(f) is None]
+        for finalizer in own_finalizers:
+            finalizers.remove(finalizer)
+        for finalizer in reversed(own_finalizers):
+            finalizer()
+        for name in [f for f, fdef in self.request._fixture_defs.items() if fdef.scope == 'function']:
+            if name in self.request._fixture_defs:
+                self.reset_fixture(name)
+
+    def snapshot(self):
+        """
+        Fork paused process holding current state of the fixtures.
+
+        The call returns twice. In this process it returns Snapshot (snapshot.restored is False).
+        Every session.restore(snapshot) forks the paused process and the call returns in the new process
+        again (snapshot.restored is True), with all fixtures resolved at the time of the snapshot,
+        without running any setup. Only memory is copied, external resources (files, databases, ...)
+        are shared with the snapshot. Threads are not copied to the forked processes.
+
+        Snapshots are closed by cleanup_session. Number of snapshots is limited by session.snapshots.limit.
+        (Not available on platforms without os.fork.)
+        """
+        self.pytestsession.wait_teardowns()
+        return self.pytestsession.snapshots.take(self)
+
+    def setfixture(self, fixture, value):
+        """
+        Add fixture to the test.
+        - It can override some fixture or create new fixture (not even related to this test).
+        - Check if no other test is active.
+        - Check if the fixture is not already resolved.
+
+        :param fixture: name of the fixture
+        :param value:
+            - fixture (method decorated with @pytest.fixture)
+            - callable (function should return fixture value)
+            - any other (will be used as returned value for the fixture)
+        """
+        self.setfixtures({fixture: value})
+
+    def setfixtures(self, fixtures, scope=None):
+        """
+        Add multiple fixtures to the test (see setfixture), nothing is added if some fixture can't be set.
+
+        :param fixtures: dict with fixture names mapped to values (fixtures, callables or other values)
+        :param scope: (default scope of decorated fixture, 'session' for values and callables) scope of the fixtures
+        """
+        if not self.can_be_used:
+            raise ValueError("Can't set fixture value. Other test is active.")
+        resolved = [f for f in fixtures if f in self.request._fixture_defs]
+        if resolved:
+            raise ValueError(f"Fixture is already set: {', '.join(resolved)}.")
+        for fixture, value in fixtures.items():
+            add_fixture_to_test(fixture, value, self.request, scope)
+            self.pytestsession.state.emit('override', self.test, fixture)
+
+    def get_fixture_code(self, fixture, all_defs=False):
+        """
+        Return code of the fixture as a string.
+        Useful in IPython:
+            [1] function_code = test.get_fixture_code('fixture_name')
             [2] %edit function_code
         
         :param fixture: name of the fixture
@@ -260,9 +1603,9 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
         """
         fixturedefs = self.request._arg2fixturedefs.get(fixture, None)
         if all_defs:
-            return [inspect.getsource(fd.func) for fd in fixturedefs]
+            return [source_index.source(fd.func) for fd in fixturedefs]
         else:
-            return inspect.getsource(fixturedefs[-1].func)
+            return source_index.source(fixturedefs[-1].func)
     
     def get_test_code(self):
         """
@@ -271,7 +1614,7 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
             [1] function_code = test.get_fixture_code('fixture_name')
             [2] %edit function_code
         """
-        return inspect.getsource(self.test.function)
+        return source_index.source(self.test.function)
 
     def print_fixtures(self, fixtures=None):
         """ print all fixtures in this test with their code """
@@ -287,9 +1630,9 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
                 continue
             print(f)
             for fd in fixturedefs:
-                print(' ' * 2 + compat.getlocation(fd.func, py.path.local()))
+                print(' ' * 2 + source_index.location(fd.func))
                 try:
-                    print(*map(lambda s: ' ' * 4 + s, inspect.getsource(fd.func).splitlines()), sep='\n')
+                    print(*map(lambda s: ' ' * 4 + s, source_index.source(fd.func).splitlines()), sep='\n')
                 except OSError:
                     print(f"{' '*4}COULD NOT FIND CODE FOR {fd.baseid}")
             print()
@@ -298,12 +1641,19 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
         return f"<PytestTest {self.test.name}{' (active)' if self.active else ''}>"
 
     def __str__(self):
-        getpath = lambda func: compat.getlocation(func, py.path.local())
+        return '\n'.join(self.iter_lines())
+
+    def iter_lines(self):
+        """ Generate lines of the table with fixtures of this test (same as str(test)). """
+        return self._iter_lines(self.pytestsession.active_test)
+
+    def _iter_lines(self, active_test):
+        getpath = source_index.location
         name = self.test.name
         test_path = getpath(self.test.function)
-        if self.active:
+        if active_test == self:
             name += ' (active)'
-        elif not self.can_be_used:
+        elif active_test is not None:
             name += " (can't use - other test is active)"
 
         fixturedefs = self.request._arg2fixturedefs
@@ -323,9 +1673,9 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
                         fd_name += ' *'
                     fixtures.append((fd_name, str(f.argnames), getpath(f.func)))
             
-        fixture_names_len = max(*map(len, map(itemgetter(0), fixtures)))
-        fixture_args_len = max(*map(len, map(itemgetter(1), fixtures)))
-        fixture_paths_len = max(*map(len, map(itemgetter(2), fixtures)))
+        fixture_names_len = max(map(len, map(itemgetter(0), fixtures)), default=0)
+        fixture_args_len = max(map(len, map(itemgetter(1), fixtures)), default=0)
+        fixture_paths_len = max(map(len, map(itemgetter(2), fixtures)), default=0)
 
         line = '+-' + '-+-'.join(('-' * col_size for col_size in (fixture_names_len, fixture_args_len, fixture_paths_len))) + '-+'
 
@@ -339,66 +1689,1859 @@ class PytestTest(namedtuple('PytestTest', 'test, pytestsession')):
         
         title_size = max(len(line) - 4, len(test_path), len(name))
 
-        lines = [
-            '#' * (title_size + 4),
-            f'# {name.center(title_size)} #',
-            '#' * (title_size + 4),
-            f'| {getpath(self.test.function).center(title_size)} |',
-            line,
-        ]
+        yield '#' * (title_size + 4)
+        yield f'# {name.center(title_size)} #'
+        yield '#' * (title_size + 4)
+        yield f'| {test_path.center(title_size)} |'
+        yield line
         for fname, args, path in fixtures:
-            lines.append(get_fixture_line(fname, args, path))
-            lines.append(line)
-        
+            yield get_fixture_line(fname, args, path)
+            yield line
+
         if self.request._fixture_defs:
-            lines.append('*) these fixtures are currently resolved resolved')
-        
-        return '\n'.join(lines)
+            yield '*) these fixtures are currently resolved resolved'
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and other.test == self.test and other.session is self.session
 
 
-def add_fixture_to_test(fixture_name, fixture, request):
+class FixtureResolver:
+    """ Resolve fixtures of the request in thread pool along their dependency graph (see getfixturevalues). """
+
+    def __init__(self, request, max_workers=None):
+        self.request = request
+        self.max_workers = max_workers
+
+    def get_dependencies(self, fixtures):
+        """
+        Dependencies of all unresolved fixtures needed for the fixtures.
+
+        Fixture overriding a fixture of the same name (`def db(db)`) depends also on the dependencies
+        of the overridden fixtures (they are set up in the same thread).
+
+        :return: dict with fixture names mapped to names of unresolved fixtures they depend on
+            (ordered the same way as pytest resolves them one by one)
+        """
+        request = self.request
+        dependencies = {}
+
+        def visit(name):
+            if name == 'request' or name in request._fixture_defs or name in dependencies:
+                return
+            argnames = list(dict.fromkeys(self._get_argnames(name)))
+            dependencies[name] = None
+            for argname in argnames:
+                visit(argname)
+            dependencies.pop(name)
+            dependencies[name] = [a for a in argnames if a != 'request' and a not in request._fixture_defs]
+
+        for fixture in fixtures:
+            visit(fixture)
+        return dependencies
+
+    def _get_argnames(self, name):
+        """ Argnames of the fixture definition used for name and of definitions overridden by it. """
+        request = self.request
+        fixturedefs = request._arg2fixturedefs.get(name)
+        if fixturedefs is None:
+            fixturedefs = request._fixturemanager.getfixturedefs(name, request._pyfuncitem.parent.nodeid)
+
+        def get_argnames(index):
+            for argname in fixturedefs[index].argnames:
+                if argname != name:
+                    yield argname
+                elif -index < len(fixturedefs):
+                    yield from get_argnames(index - 1)
+
+        return get_argnames(request._arg2index.get(name, 0) - 1) if fixturedefs else ()
+
+    def resolve(self, fixtures):
+        request = self.request
+        dependencies = self.get_dependencies(fixtures)
+        if not dependencies:
+            return
+        order = {name: i for i, name in enumerate(dependencies)}
+        dependents = defaultdict(list)
+        for name, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        waiting = {name: len(deps) for name, deps in dependencies.items()}
+
+        setupstate = request.session._setupstate
+        finalizers = {colitem: len(fins) for colitem, fins in setupstate._finalizers.items()}
+        resolved = {fd: len(fd._finalizers) for fd in request._fixture_defs.values() if hasattr(fd, '_finalizers')}
+        fixture_defs = set(request._fixture_defs)
+
+        errors = {}
+        with futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='ifixture') as executor:
+            running = {}
+
+            def submit(name):
+                running[executor.submit(request._get_active_fixturedef, name)] = name
+
+            for name in dependencies:
+                if not waiting[name]:
+                    submit(name)
+            while running:
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        errors[name] = future.exception()
+                        continue
+                    for dependent in dependents[name]:
+                        waiting[dependent] -= 1
+                        if not waiting[dependent] and not errors:
+                            submit(dependent)
+
+        self._reorder(order, setupstate, finalizers, resolved, fixture_defs)
+        if errors:
+            raise errors[min(errors, key=order.get)]
+
+    def _reorder(self, order, setupstate, finalizers, resolved, fixture_defs):
+        """ Sort finalizers and resolved fixtures registered by parallel setup to the serial setup order. """
+        def get_order(finalizer):
+            return order.get(_get_finalizer_fixture_name(finalizer), len(order))
+
+        def sort_tail(fins, start):
+            fins[start:] = sorted(fins[start:], key=get_order)
+
+        for colitem, fins in setupstate._finalizers.items():
+            sort_tail(fins, finalizers.get(colitem, 0))
+        new_colitems = sorted(
+            (c for c in setupstate._finalizers if c not in finalizers),
+            key=lambda c: min(map(get_order, setupstate._finalizers[c]), default=len(order))
+        )
+        for colitem in new_colitems:
+            setupstate._finalizers[colitem] = setupstate._finalizers.pop(colitem)
+        for fixturedef, start in resolved.items():
+            sort_tail(fixturedef._finalizers, start)
+
+        new_fixture_defs = sorted(
+            (f for f in self.request._fixture_defs if f not in fixture_defs), key=lambda f: order.get(f, len(order))
+        )
+        for name in new_fixture_defs:
+            self.request._fixture_defs[name] = self.request._fixture_defs.pop(name)
+
+
+class AsyncFixtures:
+    """
+    Plugin running coroutine and async generator fixtures on event loop.
+
+    loop: loop used for async fixtures (set by PytestTest.agetfixturevalues), if it is not set,
+        loop running in separate thread is used (it is started with the first async fixture)
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._managed_loop = None
+        self._managed_thread = None
+
+    def get_managed_loop(self):
+        # not a property, pytest reads all attributes of plugins looking for fixtures
+        if self._managed_loop is None:
+            self._managed_loop = asyncio.new_event_loop()
+            self._managed_thread = threading.Thread(
+                target=self._managed_loop.run_forever, name='ifixture-loop', daemon=True)
+            self._managed_thread.start()
+        return self._managed_loop
+
+    @_hookimpl(tryfirst=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        fixturefunc = fixtures.resolve_fixture_function(fixturedef, request)
+        is_asyncgen = inspect.isasyncgenfunction(fixturefunc)
+        if not (is_asyncgen or inspect.iscoroutinefunction(fixturefunc)):
+            return None
+
+        kwargs = {}
+        for argname in fixturedef.argnames:
+            fixdef = request._get_active_fixturedef(argname)
+            request._check_scope(argname, request.scope, fixdef.scope)
+            kwargs[argname] = fixdef.cached_result[0]
+
+        loop = self.loop or self.get_managed_loop()
+        my_cache_key = request.param_index
+        try:
+            if is_asyncgen:
+                generator = fixturefunc(**kwargs)
+                result = self.run(loop, _setup_async_generator(generator))
+                request.addfinalizer(lambda: self.run(loop, _teardown_async_generator(generator)))
+            else:
+                result = self.run(loop, fixturefunc(**kwargs))
+        except outcomes.TEST_OUTCOME:
+            fixturedef.cached_result = (None, my_cache_key, sys.exc_info())
+            raise
+        fixturedef.cached_result = (result, my_cache_key, None)
+        return result
+
+    def run(self, loop, coroutine):
+        """ Run coroutine on the loop and wait for the result. """
+        if not loop.is_running():
+            return loop.run_until_complete(coroutine)
+        if asyncio._get_running_loop() is loop:
+            coroutine.close()
+            raise RuntimeError("Can't wait for async fixture in its event loop thread, use async api (e.g. ateardown).")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def pytest_unconfigure(self):
+        if self._managed_loop is not None:
+            self._managed_loop.call_soon_threadsafe(self._managed_loop.stop)
+            self._managed_thread.join(timeout=5)
+            if not self._managed_thread.is_alive():
+                self._managed_loop.close()
+            self._managed_loop = self._managed_thread = None
+
+
+async def _setup_async_generator(generator):
+    try:
+        return await generator.__anext__()
+    except StopAsyncIteration:
+        raise ValueError(f"{generator.__name__} did not yield a value")
+
+
+async def _teardown_async_generator(generator):
+    try:
+        await generator.__anext__()
+    except StopAsyncIteration:
+        return
+    raise ValueError(f"{generator.__name__} has more than one 'yield'")
+
+
+class FixtureGraph:
+    """
+    Plugin recording dependencies between fixtures created by `request.getfixturevalue` in fixture setup
+    (the dependency may be set up by the call or resolved before).
+
+    edges: dict with items mapped to sets of (dependent fixture, dependency fixture)
+    """
+
+    def __init__(self):
+        self.edges = {}
+
+    @_hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        # request is passed to the fixture function, calls of its getfixturevalue are recorded during the setup
+        # (also for fixtures which are already resolved)
+        getfixturevalue = request.getfixturevalue
+
+        def recording_getfixturevalue(argname):
+            if argname != fixturedef.argname and argname not in fixturedef.argnames:
+                self.edges.setdefault(request._pyfuncitem, set()).add((fixturedef.argname, argname))
+            return getfixturevalue(argname)
+
+        request.getfixturevalue = recording_getfixturevalue
+        try:
+            yield
+        finally:
+            del request.getfixturevalue
+
+
+def _get_finalizer_fixture_name(finalizer):
+    return getattr(_get_finalizer_fixturedef(finalizer), 'argname', None)
+
+
+def _get_finalizer_fixturedef(finalizer):
+    fixturedef = getattr(getattr(finalizer, 'func', None), '__self__', None)
+    return fixturedef if hasattr(fixturedef, 'argname') else None
+
+
+def _get_active_item(setupstate):
+    """ Item which resolved fixtures finalized by the setupstate (None if there are no fixtures). """
+    for finalizers in setupstate._finalizers.values():
+        for finalizer in finalizers:
+            request = getattr(finalizer, 'keywords', {}).get('request')
+            if request is not None:
+                return request._pyfuncitem
+    return None
+
+
+def _finish_fixtures(finalizers, memory):
+    """ Call finalizers (pairs of fixture name and finish) of reset fixtures, return errors (name and exc_info). """
+    exceptions = []
+    for name, finish in finalizers:
+        try:
+            finish()
+        except Exception:
+            exceptions.append((name, sys.exc_info()))
+    memory.check_leaks()
+    return exceptions
+
+
+def _finish_collectors(setupstate, memory):
+    """ Call finalizers of all nodes in (detached) setupstate, return errors (nodeid and exc_info). """
+    exceptions = []
+    for colitem in _get_teardown_order(setupstate):
+        try:
+            setupstate._callfinalizers(colitem)
+        except Exception:
+            exceptions.append((colitem.nodeid, sys.exc_info()))
+    memory.check_leaks()
+    return exceptions
+
+
+def _print_teardown_errors(exceptions):
+    for name, exc in exceptions:
+        print(f"ERROR IN TEARDOWN FIXTURE [{name}]:")
+        traceback.print_exception(*exc)
+
+
+class TeardownQueue:
+    """
+    Plugin calling finalizers of detached fixtures on background thread (see PytestSession.defer_teardowns).
+
+    enabled: teardowns are deferred
+    pending: fixturedefs mapped to number of pending jobs finishing them
+    errors: errors (name and exc_info) of finished jobs, which were not raised yet (see raise_errors)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.pending = {}
+        self.errors = []
+        self._jobs = 0
+        self._condition = threading.Condition()
+        self._executor = None
+
+    def detach(self, pytestsession, colitems):
+        """ Detach finalizers of colitems from setupstate of the session and call them on background thread. """
+        setupstate = pytestsession.session._setupstate
+        detached = runner.SetupState()
+        for colitem in colitems:
+            detached._finalizers[colitem] = setupstate._finalizers.pop(colitem)
+        memory = pytestsession.config.pluginmanager.get_plugin('ifixture-memory')
+        finalizers = [f for finalizers in detached._finalizers.values() for f in finalizers]
+        self.submit(pytestsession, functools.partial(_finish_collectors, detached, memory), finalizers)
+
+    def submit(self, pytestsession, job, finalizers):
+        """
+        Call job on background thread, finalizers are detached finalizers called by the job.
+
+        Fixtures finished by the finalizers are released at once (they are not resolved anymore), their cached
+        values are kept until the finalizers run, so execution of the fixtures waits for the job before using them.
+        The job returns list of errors (name and exc_info).
+        """
+        fixturedefs = {_get_finalizer_fixturedef(f) for f in finalizers} - {None}
+        pytestsession.state.release(fixturedefs)
+        with self._condition:
+            for fixturedef in fixturedefs:
+                self.pending[fixturedef] = self.pending.get(fixturedef, 0) + 1
+                # shadows FixtureDef.execute, which returns cached value without calling pytest_fixture_setup
+                fixturedef.execute = functools.partial(self._execute, fixturedef)
+            self._jobs += 1
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(1, thread_name_prefix='ifixture-teardown')
+        self._executor.submit(self._run, job, fixturedefs)
+
+    def _run(self, job, fixturedefs):
+        try:
+            errors = job()
+        except BaseException:
+            errors = [('teardown', sys.exc_info())]
+        finally:
+            with self._condition:
+                self.errors.extend(errors)
+                for fixturedef in fixturedefs:
+                    self.pending[fixturedef] -= 1
+                    if not self.pending[fixturedef]:
+                        del self.pending[fixturedef]
+                        vars(fixturedef).pop('execute', None)
+                self._jobs -= 1
+                self._condition.notify_all()
+
+    def _execute(self, fixturedef, request):
+        self.wait(fixturedef)
+        return fixturedef.execute(request)
+
+    def wait(self, fixturedef=None):
+        """ Wait for all pending jobs (or only jobs finishing the fixturedef). """
+        with self._condition:
+            if fixturedef is None:
+                self._condition.wait_for(lambda: not self._jobs)
+            else:
+                self._condition.wait_for(lambda: fixturedef not in self.pending)
+
+    def raise_errors(self):
+        """ Raise the first error of finished jobs (like teardown_all), errors are raised only once. """
+        with self._condition:
+            errors, self.errors = self.errors, []
+        if errors:
+            _, exc = errors[0]
+            raise exc[1].with_traceback(exc[2])
+
+    def pytest_unconfigure(self):
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class StateEvent(namedtuple('StateEvent', 'kind, test, fixture, time')):
+    """
+    Change of the session state (see PytestSession.subscribe).
+
+    kind: 'setup', 'teardown', 'reset', 'override', 'revert' (of session override) or 'switch'
+    test: nodeid of the test (None for session overrides)
+    fixture: name of the fixture (None for 'switch')
+    time: time.time() of the change
+    """
+    __slots__ = ()
+
+
+class SessionState:
+    """
+    Plugin tracking the active test incrementally from fixture setup and teardown hooks.
+    Nothing is tracked until it is started (PytestSession.track_state or subscribe).
+
+    test: active item (item which resolved the first fixture), None if no fixture is resolved
+    resolved: set of resolved FixtureDefs
+    subscribers: callables called with StateEvent on every change
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.test = None
+        self.resolved = set()
+        self.subscribers = []
+        self._lock = threading.Lock()
+
+    def start(self, setupstate):
+        """ Start tracking, fixtures already resolved are found in finalizers of the setupstate. """
+        with self._lock:
+            self.resolved = {
+                fixturedef for finalizers in setupstate._finalizers.values()
+                for fixturedef in map(_get_finalizer_fixturedef, finalizers) if fixturedef is not None
+            }
+            self.test = _get_active_item(setupstate) if self.resolved else None
+            self.enabled = True
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+            self.test = None
+            self.resolved = set()
+
+    def emit(self, kind, test, fixture=None):
+        event = StateEvent(kind, test and test.nodeid, fixture, time.time())
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(event)
+            except Exception:
+                traceback.print_exc()
+
+    def switch(self, test):
+        with self._lock:
+            self.test = test if self.resolved else None
+        self.emit('switch', test)
+
+    def release(self, fixturedefs):
+        """ Mark fixtures as finished before their finalizers are called (see TeardownQueue). """
+        with self._lock:
+            released = [f for f in fixturedefs if f in self.resolved]
+            self.resolved.difference_update(released)
+            test = self.test
+            if not self.resolved:
+                self.test = None
+        for fixturedef in released:
+            self.emit('teardown', test, fixturedef.argname)
+
+    @_hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            if self.test is None:
+                self.test = request._pyfuncitem
+            self.resolved.add(fixturedef)
+        yield
+        self.emit('setup', request._pyfuncitem, fixturedef.argname)
+
+    def pytest_fixture_post_finalizer(self, fixturedef, request):
+        with self._lock:
+            if fixturedef not in self.resolved:
+                return
+            self.resolved.discard(fixturedef)
+            if not self.resolved:
+                self.test = None
+        self.emit('teardown', request._pyfuncitem, fixturedef.argname)
+
+
+class Override(namedtuple('Override', 'pytestsession, fixturedefs')):
+    """
+    Fixtures overridden for the whole session (see PytestSession.override).
+
+    pytestsession: PytestSession
+    fixturedefs: overriding FixtureDefs
+    """
+    __slots__ = ()
+
+    def revert(self):
+        """ Remove the overrides, resolved overriding fixtures (and fixtures depending on them) are reset. """
+        active_test = self.pytestsession.active_test
+        for fixturedef in self.fixturedefs:
+            if active_test and active_test.request._fixture_defs.get(fixturedef.argname) is fixturedef:
+                active_test.reset_fixture(fixturedef.argname)
+        self.pytestsession.config.pluginmanager.get_plugin('ifixture-overrides').remove(
+            self.fixturedefs, self.pytestsession.session.items)
+        for fixturedef in self.fixturedefs:
+            self.pytestsession.state.emit('revert', None, fixturedef.argname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.revert()
+
+
+class FixtureOverrides:
+    """
+    Plugin with fixtures overridden for the whole session (see PytestSession.override).
+
+    Overriding FixtureDefs are kept as the last definitions of the fixtures in fixture manager, in fixture infos
+    of items and in their requests (also for items collected later).
+
+    session: pytest session
+    fixturedefs: dict with fixture names mapped to lists of overriding FixtureDefs (the last one is used)
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.fixturedefs = {}
+
+    def add(self, fixturedefs, items):
+        for fixturedef in fixturedefs:
+            self.fixturedefs.setdefault(fixturedef.argname, []).append(fixturedef)
+        self._apply(items, {fd.argname for fd in fixturedefs})
+
+    def remove(self, fixturedefs, items):
+        for fixturedef in fixturedefs:
+            overrides = self.fixturedefs.get(fixturedef.argname, [])
+            if fixturedef in overrides:
+                overrides.remove(fixturedef)
+            if not overrides:
+                self.fixturedefs.pop(fixturedef.argname, None)
+        self._apply(items, {fd.argname for fd in fixturedefs}, set(fixturedefs))
+
+    def _apply(self, items, names, removed=frozenset()):
+        """ Make overriding FixtureDefs of the names the last FixtureDefs (without removed FixtureDefs). """
+        overrides = {name: self.fixturedefs.get(name, []) for name in names}
+
+        def update(arg2fixturedefs, name, keep_missing=False):
+            fixturedefs = arg2fixturedefs.get(name)
+            if fixturedefs is None and not keep_missing:
+                return
+            fixturedefs = [fd for fd in fixturedefs or () if fd not in removed and fd not in overrides[name]]
+            fixturedefs += overrides[name]
+            if fixturedefs:
+                arg2fixturedefs[name] = type(arg2fixturedefs.get(name, ()))(fixturedefs)
+            else:
+                arg2fixturedefs.pop(name, None)
+
+        for name in names:
+            update(self.session._fixturemanager._arg2fixturedefs, name, keep_missing=True)
+        fixtureinfos = {}
+        for item in items:
+            fixtureinfo = getattr(item, '_fixtureinfo', None)
+            if fixtureinfo is not None:
+                fixtureinfos[id(fixtureinfo)] = fixtureinfo
+            request = getattr(item, '_request', None)
+            if request is not None:
+                for name in names:
+                    update(request._arg2fixturedefs, name)
+        for fixtureinfo in fixtureinfos.values():
+            for name in names:
+                update(fixtureinfo.name2fixturedefs, name)
+
+    def pytest_collection_modifyitems(self, items):
+        if self.fixturedefs:
+            self._apply(items, set(self.fixturedefs))
+
+
+class FixtureSources:
+    """
+    Plugin keeping sources of test modules and conftests with resolved fixtures, as they were when they were
+    imported, so changed functions can be found and reloaded in place (see PytestSession.reload_fixtures).
+    Nothing is kept until it is started (PytestSession.track_sources).
+
+    index: TestIndex (only its files are kept, if they were not changed since collection)
+    sources: dict with paths mapped to sources (bytes)
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.enabled = False
+        self.sources = {}
+
+    def start(self, setupstate):
+        """ Start keeping sources, also sources of fixtures already resolved in the setupstate. """
+        self.enabled = True
+        for finalizers in list(setupstate._finalizers.values()):
+            for finalizer in finalizers:
+                fixturedef = _get_finalizer_fixturedef(finalizer)
+                if fixturedef is not None:
+                    self.keep_fixture(fixturedef, finalizer.keywords['request'])
+
+    def stop(self):
+        self.enabled = False
+        self.sources = {}
+
+    def keep(self, path):
+        if path in self.sources or path not in self.index.stamps:
+            return
+        try:
+            with open(path, 'rb') as f:
+                source = f.read()
+        except OSError:
+            return
+        if _get_file_stamp(path) == self.index.stamps[path]:
+            self.sources[path] = source
+
+    def keep_fixture(self, fixturedef, request):
+        func = compat.get_real_func(fixturedef.func)
+        code = getattr(func, '__code__', None)
+        if code is not None:
+            self.keep(code.co_filename)
+        self.keep(str(request._pyfuncitem.fspath))
+
+    @_hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if self.enabled:
+            self.keep_fixture(fixturedef, request)
+        yield
+
+    def reload(self, module, path, config):
+        """
+        Replace code of changed functions of the module by code from the file.
+
+        :return: set of changed functions, None if the file has other changes than function bodies
+        """
+        try:
+            with open(path, 'rb') as f:
+                source = f.read()
+            old_tree, new_tree = ast.parse(self.sources[path], path), ast.parse(source, path)
+        except (OSError, SyntaxError):
+            return None
+        if _get_skeleton(old_tree.body) != _get_skeleton(new_tree.body):
+            return None
+        old_codes = _get_function_codes(compile(old_tree, path, 'exec'))
+        new_codes = _get_function_codes(compile(new_tree, path, 'exec'))
+        if '@py_builtins' in vars(module):
+            # module was imported with rewritten asserts
+            from _pytest.assertion.rewrite import rewrite_asserts
+            rewrite_asserts(new_tree, py.path.local(path), config)
+            rewritten = _get_function_codes(compile(new_tree, path, 'exec'))
+            new_codes = {name: (key, rewritten[name][1]) for name, (key, _) in new_codes.items() if name in rewritten}
+
+        # all functions are checked before any code is replaced, so the module is never reloaded partially
+        replaced = []
+        for name, (key, code) in new_codes.items():
+            obj = module
+            for part in name.split('.'):
+                obj = getattr(obj, part, None)
+            func = compat.get_real_func(obj) if obj is not None else None
+            func = getattr(func, '__func__', func)
+            if not inspect.isfunction(func) or func.__code__.co_name != code.co_name:
+                continue
+            if len(func.__code__.co_freevars) != len(code.co_freevars):
+                return None
+            replaced.append((func, code, old_codes.get(name, (None,))[0] != key))
+
+        changed = set()
+        for func, code, is_changed in replaced:
+            func.__code__ = code
+            if is_changed:
+                changed.add(func)
+        self.sources[path] = source
+        return changed
+
+
+def _get_skeleton(body):
+    """ Statements of module (or class) without bodies of functions. """
+    skeleton = []
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            skeleton.append((type(node).__name__, node.name, ast.dump(node.args),
+                             [ast.dump(d) for d in node.decorator_list], node.returns and ast.dump(node.returns)))
+        elif isinstance(node, ast.ClassDef):
+            skeleton.append((node.name, [ast.dump(n) for n in (*node.bases, *node.keywords, *node.decorator_list)],
+                             _get_skeleton(node.body)))
+        else:
+            skeleton.append(ast.dump(node))
+    return skeleton
+
+
+def _get_function_codes(code, prefix=''):
+    """ Code objects of functions and classes defined in code, mapped by qualified name to (key, code). """
+    codes = {}
+    for const in code.co_consts:
+        if inspect.iscode(const) and not const.co_name.startswith('<'):
+            name = prefix + const.co_name
+            codes[name] = (_get_code_key(const), const)
+            codes.update(_get_function_codes(const, name + '.'))
+    return codes
+
+
+def _get_code_key(code):
+    """ Code object without line numbers (it is the same, if only position of the function in file was changed). """
+    return (
+        code.co_code, code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars, code.co_argcount,
+        code.co_kwonlyargcount, code.co_flags,
+        tuple(_get_code_key(c) if inspect.iscode(c) else (type(c), c) for c in code.co_consts),
+    )
+
+
+class FixtureTiming(namedtuple('FixtureTiming', 'test, fixture, phase, scope, param, parent, start, wall, cpu, thread')):
+    """
+    Duration of fixture setup or teardown.
+
+    test: nodeid of the test
+    fixture: name of the fixture
+    phase: 'setup' or 'teardown'
+    scope: scope of the fixture
+    param: repr of fixture param (None for not parametrized fixture)
+    parent: name of the fixture requesting this fixture (None if requested by the test)
+    start: time.perf_counter() at the start
+    wall: wall time in seconds
+    cpu: cpu time of the thread in seconds
+    thread: thread identifier
+    """
+    __slots__ = ()
+
+
+class FixtureStats(namedtuple('FixtureStats', 'count, wall, cpu, wall_max')):
+    """ Aggregated timings of one fixture phase (total wall and cpu time, max wall time). """
+    __slots__ = ()
+
+    @property
+    def wall_mean(self):
+        return self.wall / self.count
+
+
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def _measure_call(func, kwargs, profiler=None):
+    """ Call func(**kwargs), return its wall and cpu time. """
+    if profiler is not None:
+        profiler.enable()
+    start, cpu_start = time.perf_counter(), _thread_time()
+    try:
+        func(**kwargs)
+    finally:
+        end, cpu_end = time.perf_counter(), _thread_time()
+        if profiler is not None:
+            profiler.disable()
+    return end - start, cpu_end - cpu_start
+
+
+async def _measure_coroutine(coroutine, profiler=None):
+    """ Await the coroutine, return its wall and cpu time (cpu time of the loop thread). """
+    if profiler is not None:
+        profiler.enable()
+    start, cpu_start = time.perf_counter(), _thread_time()
+    try:
+        await coroutine
+    finally:
+        end, cpu_end = time.perf_counter(), _thread_time()
+        if profiler is not None:
+            profiler.disable()
+    return end - start, cpu_end - cpu_start
+
+
+class RunStats(namedtuple('RunStats', 'test, wall, cpu, profile')):
+    """
+    Timings of repeated calls of the test function (see PytestTest.run).
+
+    test: nodeid of the test
+    wall: wall times of the measured calls in seconds
+    cpu: cpu times of the thread of the measured calls in seconds
+    profile: pstats.Stats of the measured calls (None if they were not profiled)
+    """
+    __slots__ = ()
+
+    @property
+    def min(self):
+        return min(self.wall)
+
+    @property
+    def median(self):
+        return statistics.median(self.wall)
+
+    @property
+    def p95(self):
+        """ 95th percentile of wall times (nearest rank). """
+        wall = sorted(self.wall)
+        return wall[-(-len(wall) * 95 // 100) - 1]
+
+    @property
+    def cpu_mean(self):
+        return sum(self.cpu) / len(self.cpu)
+
+    def __str__(self):
+        return (
+            f'{self.test}: {len(self.wall)} runs, min {self.min:.6f}s, median {self.median:.6f}s, '
+            f'p95 {self.p95:.6f}s, cpu mean {self.cpu_mean:.6f}s'
+        )
+
+
+class FixtureTimings:
+    """
+    Plugin recording durations of fixture setups and teardowns.
+
+    Teardown of the fixture is measured from its first own finalizer (after finalization of fixtures depending on it)
+    to pytest_fixture_post_finalizer. Nothing is recorded until it is enabled (PytestSession.track_timings).
+
+    timings: FixtureTiming records (only last `maxlen` records are kept)
+    """
+
+    def __init__(self, maxlen=100000):
+        self.timings = deque(maxlen=maxlen)
+        self.enabled = False
+        self._teardowns = {}
+
+    @_hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if not self.enabled:
+            yield
+            return
+        start, cpu_start = time.perf_counter(), _thread_time()
+        yield
+        wall, cpu = time.perf_counter() - start, _thread_time() - cpu_start
+        info = self._get_info(fixturedef, request)
+        self.timings.append(FixtureTiming(*info[:2], 'setup', *info[2:], start, wall, cpu, threading.get_ident()))
+        fixturedef.addfinalizer(functools.partial(self._start_teardown, fixturedef, info))
+
+    def _get_info(self, fixturedef, request):
+        param = repr(request.param) if hasattr(request, 'param') else None
+        parent = getattr(getattr(request, '_parent_request', None), 'fixturename', None)
+        return request._pyfuncitem.nodeid, fixturedef.argname, request.scope, param, parent
+
+    def _start_teardown(self, fixturedef, info):
+        self._teardowns[fixturedef] = (info, time.perf_counter(), _thread_time())
+
+    def pytest_fixture_post_finalizer(self, fixturedef):
+        try:
+            info, start, cpu_start = self._teardowns.pop(fixturedef)
+        except KeyError:
+            return
+        wall, cpu = time.perf_counter() - start, _thread_time() - cpu_start
+        self.timings.append(FixtureTiming(*info[:2], 'teardown', *info[2:], start, wall, cpu, threading.get_ident()))
+
+    def get_stats(self):
+        stats = {}
+        for t in list(self.timings):
+            count, wall, cpu, wall_max = stats.get((t.fixture, t.phase), (0, 0.0, 0.0, 0.0))
+            stats[(t.fixture, t.phase)] = FixtureStats(count + 1, wall + t.wall, cpu + t.cpu, max(wall_max, t.wall))
+        return stats
+
+    def export_trace(self, path):
+        pid = os.getpid()
+        events = [
+            {
+                'name': t.fixture,
+                'cat': t.phase,
+                'ph': 'X',
+                'ts': t.start * 1e6,
+                'dur': t.wall * 1e6,
+                'pid': pid,
+                'tid': t.thread,
+                'args': {'test': t.test, 'scope': t.scope, 'param': t.param, 'parent': t.parent, 'cpu': t.cpu},
+            }
+            for t in list(self.timings)
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class FixtureAllocation(namedtuple('FixtureAllocation', 'test, fixture, scope, size, count, sites')):
+    """
+    Memory allocated by fixture setup (and still allocated after it).
+
+    test: nodeid of the test
+    fixture: name of the fixture
+    scope: scope of the fixture
+    size: net allocated bytes
+    count: net number of allocated blocks
+    sites: list of (location 'file:lineno', net allocated bytes) of the biggest allocation sites
+    """
+    __slots__ = ()
+
+
+class FixtureLeak(namedtuple('FixtureLeak', 'test, fixture, type, referrers')):
+    """
+    Fixture value still alive after the fixture was finalized.
+
+    test: nodeid of the test
+    fixture: name of the fixture
+    type: name of the type of the value
+    referrers: list of type names of objects referring to the value
+    """
+    __slots__ = ()
+
+
+class MemoryReport(namedtuple('MemoryReport', 'allocations, leaks')):
+    """ Memory allocated by fixture setups (list of FixtureAllocation) and leaked values (list of FixtureLeak). """
+    __slots__ = ()
+
+    def by_fixture(self):
+        """ Dict with fixture name mapped to (number of setups, total net allocated bytes). """
+        result = {}
+        for a in self.allocations:
+            count, size = result.get(a.fixture, (0, 0))
+            result[a.fixture] = (count + 1, size + a.size)
+        return result
+
+    def __str__(self):
+        lines = [f'{"fixture":30} {"setups":>8} {"bytes":>14}']
+        for fixture, (count, size) in sorted(self.by_fixture().items(), key=lambda i: -i[1][1]):
+            lines.append(f'{fixture:30} {count:>8} {size:>14}')
+        for leak in self.leaks:
+            lines.append(f'LEAK: {leak.fixture} ({leak.type}) in {leak.test}, referred by {", ".join(leak.referrers)}')
+        return '\n'.join(lines)
+
+
+class FixtureMemory:
+    """
+    Plugin accounting memory allocated by fixture setups (with tracemalloc) and finding fixture values which stay
+    alive after teardown (values which can't be weakly referenced, e.g. int or dict, are not checked).
+
+    Allocations of fixtures set up concurrently (PytestTest.getfixturevalues) are not separated.
+    Nothing is recorded until start is called.
+
+    allocations: FixtureAllocation records (only last `maxlen` records are kept)
+    leaks: FixtureLeak records
+    """
+
+    def __init__(self, maxlen=10000):
+        self.allocations = deque(maxlen=maxlen)
+        self.leaks = []
+        self.top = 5
+        self.tracking = False
+        self._started_tracemalloc = False
+        self._finalized = []
+
+    def start(self, top=5):
+        self.top = top
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.tracking = True
+
+    def stop(self):
+        self.tracking = False
+        self._finalized = []
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    @_hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if not self.tracking:
+            yield
+            return
+        before = self._take_snapshot()
+        outcome = yield
+        diff = self._take_snapshot().compare_to(before, 'lineno')
+        self.allocations.append(FixtureAllocation(
+            request._pyfuncitem.nodeid, fixturedef.argname, request.scope,
+            sum(d.size_diff for d in diff), sum(d.count_diff for d in diff),
+            [(str(d.traceback[0]), d.size_diff) for d in diff[:self.top] if d.size_diff > 0],
+        ))
+        try:
+            ref = weakref.ref(outcome.get_result())
+        except Exception:
+            return
+        fixturedef.addfinalizer(
+            functools.partial(self._add_finalized, request._pyfuncitem.nodeid, fixturedef.argname, ref))
+
+    def _add_finalized(self, test, fixture, ref):
+        if self.tracking:
+            self._finalized.append((test, fixture, ref))
+
+    def check_leaks(self):
+        """ Check fixture values finalized since the last check, values still alive are added to leaks. """
+        if not self._finalized:
+            return []
+        finalized, self._finalized = self._finalized, []
+        gc.collect()
+        leaks = []
+        for test, fixture, ref in finalized:
+            value = ref()
+            if value is not None:
+                referrers = [type(r).__name__ for r in gc.get_referrers(value) if r is not finalized]
+                leaks.append(FixtureLeak(test, fixture, type(value).__name__, referrers))
+            del value
+        self.leaks.extend(leaks)
+        return leaks
+
+    def get_report(self, test=None):
+        return MemoryReport(
+            [a for a in list(self.allocations) if test is None or a.test == test],
+            [leak for leak in self.leaks if test is None or leak.test == test],
+        )
+
+
+class WorkerResult(namedtuple('WorkerResult', 'nodeid, result, error')):
+    """
+    Result of the function called in the worker (see PytestSession.map_tests).
+
+    nodeid: nodeid of the test
+    result: returned value
+    error: formatted traceback, if setup of fixtures or the function failed
+    """
+    __slots__ = ()
+
+
+# session and function of the pool, set by _init_worker only in worker processes
+_worker = None
+
+
+def _map_in_workers(pytestsession, func, nodeids, workers, chunksize, runner=None):
+    # initargs are not pickled, forked workers inherit them
+    pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker, initargs=(pytestsession, func))
+    try:
+        yield from pool.imap_unordered(runner or _run_in_worker, nodeids, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _init_worker(pytestsession, func):
+    global _worker
+    _worker = (pytestsession, func)
+    multiprocessing.util.Finalize(None, pytestsession.teardown, exitpriority=10)
+
+
+def _run_in_worker(nodeid):
+    pytestsession, func = _worker
+    try:
+        test = pytestsession.switch_to(nodeid)
+        fixture_values = test.getfixturevalues(test.test.fixturenames, parallel=False)
+        return WorkerResult(nodeid, func(fixture_values), None)
+    except Exception:
+        return WorkerResult(nodeid, None, traceback.format_exc())
+
+
+class FixtureCheck(namedtuple('FixtureCheck', 'nodeid, status, setup, fixtures, error, same_as')):
+    """
+    Result of the check of fixture closure of one test (see PytestSession.check_fixtures).
+
+    nodeid: nodeid of the test
+    status: 'passed', 'failed' or 'skipped' (fixture called pytest.skip)
+    setup: wall time of the setup of the closure in seconds (fixtures shared with previous test are not set up)
+    fixtures: dict with names of fixtures set up for this test mapped to their setup wall times
+    error: formatted traceback of failed setup
+    same_as: nodeid of the test with identical closure, which was checked instead of this test
+    """
+    __slots__ = ()
+
+
+class FixtureCheckReport(namedtuple('FixtureCheckReport', 'results, duration, workers')):
+    """
+    Report of PytestSession.check_fixtures.
+
+    results: list of FixtureCheck in order of the tests
+    duration: wall time of the whole check in seconds
+    workers: number of worker processes
+    """
+    __slots__ = ()
+
+    @property
+    def failures(self):
+        return [r for r in self.results if r.status == 'failed']
+
+    def as_dict(self):
+        """ Report as dict of JSON types. """
+        return {
+            'tests': len(self.results),
+            'checked': sum(r.same_as is None for r in self.results),
+            'failed': len(self.failures),
+            'skipped': sum(r.status == 'skipped' for r in self.results),
+            'workers': self.workers,
+            'duration': self.duration,
+            'results': [r._asdict() for r in self.results],
+        }
+
+
+def _get_closure_key(item):
+    """ Fixture definitions and param indices of fixture closure of the item. """
+    fixtureinfo = item._fixtureinfo
+    arg2fixturedefs = item._request._arg2fixturedefs
+    indices = getattr(getattr(item, 'callspec', None), 'indices', {})
+    return tuple(
+        (name, id((arg2fixturedefs.get(name) or fixtureinfo.name2fixturedefs.get(name) or [None])[-1]),
+         indices.get(name))
+        for name in fixtureinfo.names_closure
+    )
+
+
+def _check_in_worker(nodeid):
+    pytestsession, _ = _worker
+    pytestsession.track_timings()
+    timings = pytestsession.config.pluginmanager.get_plugin('ifixture-timings').timings
+    start = time.perf_counter()
+    status, error = 'passed', None
+    try:
+        test = pytestsession.switch_to(nodeid)
+        timings.clear()
+        start = time.perf_counter()
+        test.getfixturevalues(test.test.fixturenames, parallel=False)
+    except outcomes.Skipped:
+        status = 'skipped'
+    except outcomes.TEST_OUTCOME:
+        status, error = 'failed', traceback.format_exc()
+    setup = time.perf_counter() - start
+    fixtures = {t.fixture: t.wall for t in list(timings) if t.phase == 'setup' and t.test == nodeid}
+    return FixtureCheck(nodeid, status, setup, fixtures, error, None)
+
+
+class Snapshot(namedtuple('Snapshot', 'pid, test, created, restored, commands, results, owner')):
+    """
+    Paused process with state of fixtures (see PytestTest.snapshot).
+
+    pid: pid of the paused process
+    test: nodeid of the test
+    created: time of the snapshot
+    restored: True in the restored process
+    commands, results: pipes to the paused process
+    owner: pid of the process which took the snapshot
+    """
+    __slots__ = ()
+
+    def close(self):
+        """ Stop the paused process. """
+        if self.owner != os.getpid():
+            return
+        for fd in (self.commands, self.results):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        try:
+            os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            pass
+
+    def __repr__(self):
+        return f"<Snapshot {self.test} pid={self.pid}{' (restored)' if self.restored else ''}>"
+
+
+class Snapshots:
+    """
+    Plugin managing snapshots of the session (see PytestTest.snapshot).
+
+    limit: max number of snapshots, the oldest snapshot is closed when the limit is exceeded
+    """
+    RESTORE = b'r'
+
+    def __init__(self, limit=8):
+        self.limit = limit
+        self.snapshots = []
+
+    def take(self, test):
+        if not hasattr(os, 'fork'):
+            raise NotImplementedError("Snapshots need os.fork.")
+        while self.snapshots and len(self.snapshots) >= self.limit:
+            self.snapshots.pop(0).close()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        commands_r, commands_w = os.pipe()
+        results_r, results_w = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(commands_r)
+            os.close(results_w)
+            snapshot = Snapshot(pid, test.test.nodeid, time.time(), False, commands_w, results_r, os.getpid())
+            self.snapshots.append(snapshot)
+            return snapshot
+
+        os.close(commands_w)
+        os.close(results_r)
+        for other in self.snapshots:
+            os.close(other.commands)
+            os.close(other.results)
+        self.snapshots = []
+        self._serve(commands_r, results_w)
+        return Snapshot(None, test.test.nodeid, time.time(), True, None, None, None)
+
+    def _serve(self, commands, results):
+        """ Wait for restore commands in the paused process, return only in the restored process. """
+        while True:
+            if os.read(commands, 1) != self.RESTORE:
+                os._exit(0)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                os.close(commands)
+                os.close(results)
+                return
+            _, status = os.waitpid(pid, 0)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            os.write(results, f'{code}\n'.encode())
+
+    def restore(self, snapshot):
+        if snapshot not in self.snapshots:
+            raise ValueError(f"{snapshot!r} is not open snapshot of this session.")
+        os.write(snapshot.commands, self.RESTORE)
+        result = b''
+        while not result.endswith(b'\n'):
+            chunk = os.read(snapshot.results, 16)
+            if not chunk:
+                raise RuntimeError(f"{snapshot!r} was terminated.")
+            result += chunk
+        return int(result)
+
+    def close(self):
+        """ Close all snapshots. """
+        while self.snapshots:
+            self.snapshots.pop().close()
+
+    def __iter__(self):
+        return iter(self.snapshots)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def pytest_unconfigure(self):
+        self.close()
+
+
+def cache_fixture(func=None, salt=''):
+    """
+    Mark fixture function, so its value is stored in persistent cache and reused by other sessions (see FixtureCache).
+    Value has to be picklable and deterministic for the same code, params and dependencies.
+
+        @pytest.fixture(scope='session')
+        @cache_fixture(salt='v2')
+        def corpus(): ...
+
+    :param salt: change it to invalidate cached values (e.g. when data used by the fixture changed)
+    """
+    def decorator(func):
+        func._ifixture_cache_salt = str(salt)
+        return func
+    return decorator(func) if func is not None else decorator
+
+
+class CacheEntry(namedtuple('CacheEntry', 'key, fixture, size, last_used')):
+    """ Value stored in FixtureCache. """
+    __slots__ = ()
+
+
+class FixtureCache:
+    """
+    Plugin storing values of marked fixtures on the disk (in pytest cache directory by default).
+
+    Key of the value is hash of the fixture name and source code, its param, keys of its dependencies
+    (or hashes of their values, if they are not cached) and salt. Params and values are hashed by pickles
+    with sorted sets, so keys don't depend on hash randomization (see _CanonicalPickler).
+    Values are pickled (buffers of objects supporting pickle protocol 5, e.g. numpy arrays, are stored out-of-band
+    and loaded memory-mapped). The least recently used values are removed, when size of the cache exceeds max_size.
+
+    Fixtures are marked by cache_fixture decorator or by name (`add` method).
+    Value of a fixture is the result of its setup by all plugins (e.g. value awaited by AsyncFixtures).
+    On a hit the fixture function is not called (so generator fixtures are not finalized either).
+
+    size: total size of the cached values (None until it is needed)
+    """
+    SUFFIX = '.ifx'
+    DEFAULT_DIR = os.path.join('.pytest_cache', 'd', 'ifixture-values')
+    ALIGNMENT = 64
+
+    def __init__(self, path=None, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+        self.size = None
+        self.salts = {}
+        self.keys = {}
+        self.stats = {'hit': 0, 'miss': 0, 'bypass': 0}
+
+    def pytest_configure(self, config):
+        if self.path is None and getattr(config, 'cache', None) is not None:
+            self.path = str(config.cache.makedir('ifixture-values'))
+
+    def add(self, fixture, salt=''):
+        """ Cache values of the fixture with this name. """
+        self.salts[fixture] = str(salt)
+
+    def get_salt(self, fixturedef):
+        salt = getattr(compat.get_real_func(fixturedef.func), '_ifixture_cache_salt', None)
+        return self.salts.get(fixturedef.argname, salt)
+
+    @_hookimpl(hookwrapper=True, trylast=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        salt = self.get_salt(fixturedef)
+        if salt is None or self.path is None:
+            yield
+            return
+        key = self.get_key(fixturedef, request, salt)
+        if key is None:
+            self.stats['bypass'] += 1
+            yield
+            return
+
+        try:
+            value = self.load(key)
+        except (OSError, ValueError, pickle.UnpicklingError):
+            self.stats['miss'] += 1
+            outcome = yield
+            if outcome.excinfo is None:
+                try:
+                    self.store(key, fixturedef.argname, outcome.get_result())
+                except (pickle.PicklingError, TypeError, AttributeError) as exc:
+                    sys.stderr.write(f"Can't cache fixture {fixturedef.argname}: {exc}\n")
+        else:
+            self.stats['hit'] += 1
+            # the innermost wrapper, other plugins set up the fixture as usual (scope of dependencies is checked,
+            # result is cached in fixturedef), only the fixture function is replaced by the loaded value
+            func = fixturedef.func
+            fixturedef.func = lambda **kwargs: value
+            try:
+                yield
+            finally:
+                fixturedef.func = func
+        self.keys[fixturedef] = key
+
+    def pytest_fixture_post_finalizer(self, fixturedef):
+        self.keys.pop(fixturedef, None)
+
+    def get_key(self, fixturedef, request, salt):
+        """ Key of the fixture value (None if some dependency can't be hashed). """
+        key = hashlib.sha256()
+        key.update(f'{fixturedef.argname}\0{salt}\0'.encode())
+        key.update(_get_source_hash(fixturedef.func).encode())
+        try:
+            if hasattr(request, 'param'):
+                key.update(_hash_value(request.param).encode())
+            for argname in fixturedef.argnames:
+                if argname == 'request':
+                    continue
+                dependency = request._get_active_fixturedef(argname)
+                dependency_key = self.keys.get(dependency) or _hash_value(dependency.cached_result[0])
+                key.update(f'{argname}\0{dependency_key}'.encode())
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+        return key.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def store(self, key, fixture, value):
+        buffers = []
+        if sys.version_info >= (3, 8):
+            data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+            try:
+                buffers = [b.raw() for b in buffers]
+            except BufferError:
+                buffers, data = [], pickle.dumps(value, protocol=5)
+        else:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        header = json.dumps({'fixture': fixture, 'pickle': len(data), 'buffers': [b.nbytes for b in buffers]}).encode()
+        os.makedirs(self.path, exist_ok=True)
+        path = self._get_path(key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(data)
+            for buffer in buffers:
+                f.write(b'\0' * (-f.tell() % self.ALIGNMENT))
+                f.write(buffer)
+        old_stamp = _get_file_stamp(path)
+        os.replace(path + '.tmp', path)
+        if self.size is None:
+            self.size = sum(e.size for e in self.entries())
+        else:
+            self.size += os.path.getsize(path) - (old_stamp[1] if old_stamp else 0)
+        if self.size > self.max_size:
+            self.evict()
+
+    def load(self, key):
+        path = self._get_path(key)
+        with open(path, 'rb') as f:
+            header_size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size))
+            if not header['buffers']:
+                value = pickle.loads(f.read(header['pickle']))
+            else:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+                offset = 8 + header_size
+                data = view[offset:offset + header['pickle']]
+                offset += header['pickle']
+                buffers = []
+                for size in header['buffers']:
+                    offset += -offset % self.ALIGNMENT
+                    buffers.append(view[offset:offset + size])
+                    offset += size
+                value = pickle.loads(data, buffers=buffers)
+        os.utime(path)
+        return value
+
+    def entries(self):
+        """ List of CacheEntry, the most recently used first. """
+        entries = []
+        for name in os.listdir(self.path) if self.path and os.path.isdir(self.path) else ():
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, 'rb') as f:
+                    header_size, = struct.unpack('<Q', f.read(8))
+                    fixture = json.loads(f.read(header_size))['fixture']
+                stat = os.stat(path)
+            except (OSError, ValueError, struct.error):
+                continue
+            entries.append(CacheEntry(name[:-len(self.SUFFIX)], fixture, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e.last_used, reverse=True)
+
+    def purge(self, fixture=None):
+        """ Remove all cached values (or only values of the fixture). Return number of removed values. """
+        removed = 0
+        for entry in self.entries():
+            if fixture is None or entry.fixture == fixture:
+                os.remove(self._get_path(entry.key))
+                removed += 1
+        self.size = None
+        return removed
+
+    def evict(self):
+        """
+        Remove the least recently used values exceeding max_size (the most recent value is always kept).
+        Cache directory is scanned only here, store keeps the total size up to date.
+        """
+        entries = self.entries()
+        size = sum(e.size for e in entries)
+        while len(entries) > 1 and size > self.max_size:
+            entry = entries.pop()
+            os.remove(self._get_path(entry.key))
+            size -= entry.size
+        self.size = size
+
+
+def _get_source_hash(func):
+    func = compat.get_real_func(func)
+    try:
+        source = source_index.source(func).encode()
+    except (OSError, TypeError):
+        code = getattr(func, '__code__', None)
+        source = code.co_code + repr(code.co_consts).encode() if code else repr(func).encode()
+    return hashlib.sha256(source).hexdigest()
+
+
+def _hash_value(value):
+    return hashlib.sha256(_dumps_canonical(value)).hexdigest()
+
+
+def _dumps_canonical(value):
+    buffer = io.BytesIO()
+    _CanonicalPickler(buffer, protocol=4).dump(value)
+    return buffer.getvalue()
+
+
+def _save_unordered(pickler, obj):
+    pickler.save_reduce(type(obj), (sorted(obj, key=_dumps_canonical),), obj=obj)
+
+
+class _CanonicalPickler(pickle._Pickler):
+    """
+    Pickler writing items of sets and frozensets sorted by their pickles, so pickles of equal values are equal
+    in all processes (order of sets of str and bytes depends on hash randomization, see PYTHONHASHSEED).
+
+    The pure python pickler is used, the C pickler doesn't allow to change pickling of sets.
+    Subclasses of set and objects pickling unordered state on their own are not canonical.
+    """
+    dispatch = pickle._Pickler.dispatch.copy()
+    dispatch[set] = _save_unordered
+    dispatch[frozenset] = _save_unordered
+
+
+DEFAULT_SOCKET = os.path.join('.pytest_cache', 'd', 'ifixture.sock')
+
+
+class FixtureServer:
+    """
+    Server holding one PytestSession with warm fixtures for other processes (see `ifixture serve` and FixtureClient).
+
+    Clients connect over Unix domain socket. Requests are executed one by one in the thread running
+    serve_forever, so one-active-test rule of the session applies to all clients (a client can't use other test,
+    until the active test is teardowned by any client).
+    Values are pickled, large buffers (bytes-like values and buffers of objects supporting pickle protocol 5,
+    e.g. numpy arrays) are passed in shared memory.
+
+    WARNING: requests are pickled, so anybody who can connect to the socket can run any code in the server.
+    The socket is accessible only by its owner.
+
+    pytestsession: PytestSession
+    path: path of the socket
+    buffer_threshold: buffers with at least this number of bytes are passed in shared memory
+    """
+    SHM_DIR = '/dev/shm'
+
+    def __init__(self, pytestsession, path, buffer_threshold=2 ** 16):
+        self.pytestsession = pytestsession
+        self.path = path
+        self.buffer_threshold = buffer_threshold
+        self.requests = queue.Queue()
+        self._running = False
+
+    def serve_forever(self):
+        """ Handle requests until shutdown command is received. """
+        listener = self._listen()
+        threading.Thread(target=self._accept, args=(listener,), name='ifixture-server', daemon=True).start()
+        self._running = True
+        try:
+            while self._running:
+                request, reply, sent = self.requests.get()
+                reply.put(self.handle(*request))
+            sent.wait(10)  # response to shutdown
+        finally:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)  # wake up accept
+            except OSError:
+                pass
+            listener.close()
+            os.unlink(self.path)
+
+    def _listen(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                os.unlink(self.path)  # socket of terminated server
+            else:
+                raise RuntimeError(f"Server is already running on {self.path}.")
+            finally:
+                probe.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        listener.listen()
+        return listener
+
+    def _accept(self, listener):
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_client, args=(connection,), daemon=True).start()
+
+    def _serve_client(self, connection):
+        with connection:
+            while True:
+                request = _recv_message(connection)
+                if request is None:
+                    return
+                reply, sent = queue.Queue(1), threading.Event()
+                self.requests.put((request, reply, sent))
+                try:
+                    _send_message(connection, reply.get())
+                finally:
+                    sent.set()
+
+    def shutdown(self):
+        """ Stop serve_forever (it can be called from any thread). """
+        reply, sent = queue.Queue(1), threading.Event()
+        self.requests.put((('shutdown', {}), reply, sent))
+        reply.get()
+        sent.set()
+
+    def handle(self, command, kwargs):
+        """ Execute command, return response for the client. """
+        try:
+            value = getattr(self, 'cmd_' + command)(**kwargs)
+        except Exception as exc:
+            try:
+                exc = pickle.loads(pickle.dumps(exc))
+            except Exception:
+                exc = RuntimeError(f'{type(exc).__name__}: {exc}')
+            return {'error': exc, 'traceback': traceback.format_exc()}
+        try:
+            return {'value': _dump_value(value, self.buffer_threshold, self.SHM_DIR)}
+        except Exception as exc:
+            return {'error': TypeError(f"Can't send value to the client: {exc}"), 'traceback': traceback.format_exc()}
+
+    def _get_test(self, test):
+        return self.pytestsession.get_test_by_nodeid(test) if '::' in test else self.pytestsession.get_test_by_name(test)
+
+    def cmd_tests(self):
+        return [t.test.nodeid for t in self.pytestsession.tests]
+
+    def cmd_active_test(self):
+        active_test = self.pytestsession.active_test
+        return active_test and active_test.test.nodeid
+
+    def cmd_getfixturevalue(self, test, fixture):
+        return self._get_test(test).getfixturevalue(fixture)
+
+    def cmd_reset_fixture(self, test, fixture):
+        self._get_test(test).reset_fixture(fixture)
+
+    def cmd_teardown(self):
+        self.pytestsession.teardown()
+
+    def cmd_run(self, func, args=(), test=None, fixtures=None):
+        values = {}
+        if test is not None:
+            test = self._get_test(test)
+            values = test.getfixturevalues(test.test.fixturenames if fixtures is None else fixtures, parallel=False)
+        return func(*args, **values)
+
+    def cmd_shutdown(self):
+        self._running = False
+
+
+def _send_message(sock, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('<Q', len(data)) + data)
+
+
+def _recv_message(sock):
+    header = _recv_exactly(sock, 8)
+    if header is None:
+        return None
+    size, = struct.unpack('<Q', header)
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+def _recv_exactly(sock, size):
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(min(size - len(chunks), 2 ** 20))
+        if not chunk:
+            if chunks:
+                raise ConnectionError('Connection closed in the middle of message.')
+            return None
+        chunks += chunk
+    return bytes(chunks)
+
+
+def _dump_value(value, threshold, shm_dir):
+    """
+    Pickle value, large out-of-band buffers are written to a file in shared memory (see _load_value).
+
+    :return: (pickled value, path of the file with buffers or None, list of buffer sizes)
+    """
+    if sys.version_info < (3, 8):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), None, []
+
+    if isinstance(value, (bytes, bytearray, memoryview)) and memoryview(value).nbytes >= threshold:
+        value = pickle.PickleBuffer(value)
+    buffers = []
+
+    def buffer_callback(buffer):
+        try:
+            raw = buffer.raw()
+        except BufferError:
+            return True
+        if raw.nbytes < threshold:
+            return True
+        buffers.append(raw)
+        return False
+
+    data = pickle.dumps(value, protocol=5, buffer_callback=buffer_callback)
+    if not buffers:
+        return data, None, []
+
+    fd, path = tempfile.mkstemp(prefix='ifixture-', dir=shm_dir if os.path.isdir(shm_dir) else None)
+    with open(fd, 'wb') as f:
+        for buffer in buffers:
+            f.write(buffer)
+    return data, path, [b.nbytes for b in buffers]
+
+
+def _load_value(data, path, sizes):
+    """ Unpickle value from _dump_value, buffers are memory-mapped (copy on write) and the file is removed. """
+    if path is None:
+        return pickle.loads(data)
+    try:
+        with open(path, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+    finally:
+        os.unlink(path)
+    buffers, offset = [], 0
+    for size in sizes:
+        buffers.append(view[offset:offset + size])
+        offset += size
+    return pickle.loads(data, buffers=buffers)
+
+
+class FixtureClient:
+    """
+    Client of FixtureServer (`ifixture serve`).
+
+        with FixtureClient('.pytest_cache/d/ifixture.sock') as client:
+            db = client.getfixturevalue('test_articles', 'db')
+
+    Tests are identified by name or nodeid. Errors raised in the server are raised again in the client
+    (RuntimeError if the error can't be pickled). Buffers passed in shared memory are returned as memoryview.
+
+    :param path: path of the server socket
+    :param timeout: (default None) timeout of socket operations in seconds
+    """
+
+    def __init__(self, path=None, timeout=None):
+        self.path = path or DEFAULT_SOCKET
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(self.path)
+
+    def _call(self, command, **kwargs):
+        _send_message(self.socket, (command, kwargs))
+        response = _recv_message(self.socket)
+        if response is None:
+            raise ConnectionError('Server closed the connection.')
+        if 'error' in response:
+            raise response['error'] from RuntimeError(f'\n"""\n{response["traceback"]}"""')
+        return _load_value(*response['value'])
+
+    def tests(self):
+        """ Nodeids of all tests in the session. """
+        return self._call('tests')
+
+    def active_test(self):
+        """ Nodeid of the active test (None if there is no active test). """
+        return self._call('active_test')
+
+    def getfixturevalue(self, test, fixture):
+        return self._call('getfixturevalue', test=test, fixture=fixture)
+
+    def reset_fixture(self, test, fixture):
+        return self._call('reset_fixture', test=test, fixture=fixture)
+
+    def teardown(self):
+        """ Teardown all fixtures in the server session. """
+        return self._call('teardown')
+
+    def run(self, func, args=(), test=None, fixtures=None):
+        """
+        Run func(*args, **fixture_values) in the server, return its result.
+
+        :param func: picklable callable (e.g. function importable in the server)
+        :param args: positional arguments of func
+        :param test: (optional) name or nodeid of the test, func gets its fixture values as keyword arguments
+        :param fixtures: (default all fixtures requested by the test) names of fixtures passed to func
+        """
+        return self._call('run', func=func, args=tuple(args), test=test, fixtures=fixtures)
+
+    def shutdown(self):
+        """ Stop the server (fixtures are teardowned). """
+        return self._call('shutdown')
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def serve(args=None, path=None, **session_kwargs):
+    """
+    Create session and serve its fixtures on Unix domain socket until shutdown (see FixtureServer).
+
+    :param args: arguments for get_session
+    :param path: (default DEFAULT_SOCKET) path of the socket
+    :param session_kwargs: other arguments for get_session
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise NotImplementedError("Fixture server needs Unix domain sockets.")
+    pytestsession = get_session(args, **session_kwargs)
+    try:
+        FixtureServer(pytestsession, path or DEFAULT_SOCKET).serve_forever()
+    finally:
+        pytestsession.cleanup_session()
+
+
+def add_fixture_to_test(fixture_name, fixture, request, scope=None):
     """
     Replace last FixtureDef for fixture_name in request._arg2fixturedefs
     :param fixture_name: str
     :param fixture: [Value, Func, Fixture]
     :param request: FixtureRequest
+    :param scope: (default scope of the fixture, 'session' for values and callables) scope of the new FixtureDef
     :return:
     """
-    fixture_value, fixture_function, decorated_fixture = None, None, None
-    if callable(fixture):
-        fixture_function = fixture
-    else:
-        fixture_value = fixture
-        fixture_function = lambda: fixture_value
+    fixture_def = _make_fixturedef(request._fixturemanager, fixture_name, fixture, scope, default_scope='session')
+    request._arg2fixturedefs[fixture_name] = (*request._arg2fixturedefs.get(fixture_name, [])[:-1], fixture_def)
+
 
-    if hasattr(fixture_function, '_pytestfixturefunction'):
-        print('adding fixture (it is already fixture)')
-        decorated_fixture = fixture_function
-        fixture_function = decorated_fixture.__wrapped__
+def _make_fixturedef(fixturemanager, fixture_name, fixture, scope=None, default_scope='function'):
+    """
+    Create FixtureDef (visible for all nodes) from fixture, callable or value.
+
+    :param scope: scope of the FixtureDef, default is scope of decorated fixture or default_scope
+    """
+    if hasattr(fixture, '_pytestfixturefunction'):
+        marker = fixture._pytestfixturefunction
+        fixture_function = fixture.__wrapped__
+        params, ids, default_scope = marker.params, marker.ids, marker.scope
     else:
-        print('adding new created fixture')
-        decorated_fixture = pytest.fixture(scope='session')(fixture_function)
+        fixture_function = fixture if callable(fixture) else (lambda: fixture)
+        params, ids = None, None
 
-    marker = decorated_fixture._pytestfixturefunction
-    fixture_def = FixtureDef(
-        fixturemanager=request._fixturemanager,
+    return fixtures.FixtureDef(
+        fixturemanager=fixturemanager,
         baseid='',
         argname=fixture_name,
         func=fixture_function,
-        scope=marker.scope,
-        params=marker.params,
+        scope=scope or default_scope,
+        params=params,
         unittest=False,
-        ids=marker.ids
+        ids=ids
     )
-    request._arg2fixturedefs[fixture_name] = (*request._arg2fixturedefs.get(fixture_name, [])[:-1], fixture_def)
+
+
+def teardown_all(setupstate):
+    """
+    Call finalizers of all nodes in setupstate (nodes deeper in the collection tree first).
+
+    SetupState.teardown_all can't be used, because the nodes are not prepared (there is no setup stack).
+    All finalizers are called, the first exception is raised.
+    """
+    exc = None
+    for colitem in _get_teardown_order(setupstate):
+        try:
+            setupstate._callfinalizers(colitem)
+        except Exception:
+            if exc is None:
+                exc = sys.exc_info()
+    if exc:
+        raise exc[1].with_traceback(exc[2])
+
+
+def _get_teardown_order(setupstate):
+    return sorted(setupstate._finalizers, key=lambda colitem: -len(colitem.listchain()))
 
 
 def cleanup_config(config, session):
+    teardowns = config.pluginmanager.get_plugin('ifixture-teardowns')
     try:
-        session._setupstate.teardown_all()
+        if teardowns is not None:
+            teardowns.wait()
+            teardowns.raise_errors()
+    except Exception as exc:
+        sys.stderr.write('{}: {}\n'.format(type(exc).__name__, exc))
+    try:
+        teardown_all(session._setupstate)
     except Exception as exc:
         sys.stderr.write('{}: {}\n'.format(type(exc).__name__, exc))
     try:
@@ -408,3 +3551,151 @@ def cleanup_config(config, session):
     config._ensure_unconfigure()
 
 
+class SessionCleanup:
+    """
+    Cleanup of the session and config, which runs only once.
+
+    It is registered in atexit until it is called, so sessions which are not closed are cleaned up at exit
+    and closed sessions are not referenced by atexit.
+    It runs only in the process which created the session, forked processes (snapshots, workers) share fixtures
+    with it, so they must not finalize them.
+    """
+
+    def __init__(self, config, session):
+        self.config = config
+        self.session = session
+        self.closed = False
+        self.pid = os.getpid()
+        atexit.register(self)
+
+    def __call__(self):
+        if self.closed or os.getpid() != self.pid:
+            return
+        self.closed = True
+        atexit.unregister(self)
+        cleanup_config(self.config, self.session)
+
+
+def release_session(config, session):
+    """ Drop collected items, fixture definitions and plugins of cleaned up session, so they can be freed. """
+    session.items = []
+    session._setupstate._finalizers.clear()
+    session._setupstate.stack = []
+    fixturemanager = getattr(session, '_fixturemanager', None)
+    if fixturemanager is not None:
+        fixturemanager._arg2fixturedefs.clear()
+        fixturemanager._holderobjseen.clear()
+    pluginmanager = config.pluginmanager
+    for name, plugin in list(pluginmanager.list_name_plugin()):
+        if plugin is not None and pluginmanager.is_registered(plugin):
+            pluginmanager.unregister(plugin, name)
+    pluginmanager._conftest_plugins.clear()
+    pluginmanager._dirpath2confmods.clear()
+    pluginmanager._conftestpath2mod.clear()
+    # lru_cache of the method is shared by all plugin managers (they are its keys), live managers only fill it again
+    cache_clear = getattr(type(pluginmanager)._getconftestmodules, 'cache_clear', None)
+    if cache_clear is not None:
+        cache_clear()
+
+
+class SessionPool:
+    """
+    Pool of configured sessions keyed by arguments of get_session, sessions are created only once and reused.
+
+    All fixtures of the session are torn down, when it is taken from the pool again
+    (other changes like overrides or custom fixtures are kept).
+        [1] with SessionPool() as pool:
+        [2]     session = pool.get(['tests/'], profile='minimal')
+    """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def get(self, args=None, **kwargs):
+        """
+        Return session for the arguments (create it if it is not in the pool or it was closed).
+
+        :param args: arguments of pytest (see get_session)
+        :param kwargs: other keyword arguments of get_session (values must be hashable)
+        :return: PytestSession
+        """
+        key = (tuple(args or ()), tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items())))
+        pytestsession = self.sessions.get(key)
+        if pytestsession is None or pytestsession.closed:
+            pytestsession = self.sessions[key] = get_session(args, **kwargs)
+        elif pytestsession.active_test is not None:
+            pytestsession.active_test.teardown()
+        return pytestsession
+
+    def close(self):
+        """ Close all sessions of the pool. """
+        sessions, self.sessions = self.sessions, {}
+        for pytestsession in sessions.values():
+            pytestsession.close()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    """ Command line interface (ifixture command). """
+    parser = argparse.ArgumentParser(prog='ifixture', description='Tools for working with pytest fixtures.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    cache_parser = commands.add_parser('cache', help='inspect or purge persistent fixture cache')
+    cache_parser.add_argument('action', choices=['list', 'purge'])
+    cache_parser.add_argument('--fixture', help='only values of this fixture')
+    cache_parser.add_argument('--dir', default=FixtureCache.DEFAULT_DIR, help='cache directory')
+
+    serve_parser = commands.add_parser('serve', help='serve warm fixtures of the session on Unix domain socket')
+    serve_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='path of the socket')
+    serve_parser.add_argument('--profile', choices=sorted(PROFILES), default='full', help='plugin profile')
+    serve_parser.add_argument('--lazy', action='store_true', help='collect test modules only when they are needed')
+    serve_parser.add_argument('pytest_args', nargs=argparse.REMAINDER, help='arguments for pytest')
+
+    check_parser = commands.add_parser(
+        'check', help='check that fixtures of all tests can be set up, print JSON report (exit code 1 on failure)')
+    check_parser.add_argument('--workers', type=int, help='number of worker processes (default number of cpus)')
+    check_parser.add_argument('--output', help='write the report to this file instead of stdout')
+    check_parser.add_argument('--profile', choices=sorted(PROFILES), default='full', help='plugin profile')
+    check_parser.add_argument('pytest_args', nargs=argparse.REMAINDER, help='arguments for pytest')
+
+    args = parser.parse_args(argv)
+    if args.command == 'check':
+        pytest_args = args.pytest_args[1:] if args.pytest_args[:1] == ['--'] else args.pytest_args
+        # output of pytest and fixtures (also in workers) must not mix with the report
+        with contextlib.redirect_stdout(sys.stderr):
+            with get_session(pytest_args, profile=args.profile) as pytestsession:
+                report = pytestsession.check_fixtures(workers=args.workers)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report.as_dict(), output, indent=2)
+        else:
+            json.dump(report.as_dict(), sys.stdout, indent=2)
+            print()
+        return 1 if report.failures else 0
+    if args.command == 'serve':
+        pytest_args = args.pytest_args[1:] if args.pytest_args[:1] == ['--'] else args.pytest_args
+        serve(pytest_args, args.socket, profile=args.profile, lazy=args.lazy)
+        return 0
+    if args.command == 'cache':
+        cache = FixtureCache(args.dir)
+        if args.action == 'list':
+            for entry in cache.entries():
+                if args.fixture is None or entry.fixture == args.fixture:
+                    last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.last_used))
+                    print(f'{entry.key[:16]}  {entry.fixture:30} {entry.size:>12}  {last_used}')
+        else:
+            print(f'removed {cache.purge(args.fixture)} values')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import shutil
+import sys
 from pathlib import Path
 
 import pytest
@@ -27,3 +29,13 @@ def article_logger(monkeypatch):
     monkeypatch.setattr(logger, 'LOGGER', [])
     return logger.LOGGER
 
+
+
+@pytest.fixture
+def project_copy(tmpdir, monkeypatch):
+    """ Copy of tests_dir/tests, which can be changed by the test. """
+    shutil.copytree(str(TEST_DIR.joinpath('tests')), str(tmpdir.join('tests')))
+    monkeypatch.chdir(tmpdir)
+    for module in ('conftest', 'test_articles', 'test_db'):
+        monkeypatch.delitem(sys.modules, module, raising=False)
+    return tmpdir
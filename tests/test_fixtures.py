@@ -1,4 +1,12 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+
 import pytest
+from _pytest.fixtures import FixtureLookupError
 
 
 def test_get_fixture(base_session, article_logger):
@@ -174,3 +182,554 @@ def test_unresolved(base_session):
     test = base_session.get_test_by_name('test_articles')
     db = test.getfixturevalue('db')
     assert test.fixtures_unresolved.sort() == ['article', 'author'].sort()
+
+
+def test_get_fixture_values_in_parallel(base_session, article_logger):
+    test = base_session.get_test_by_name('test_db[cats]')
+    values = test.getfixturevalues(['article_new', 'db_connection'])
+    assert values == {
+        'article_new': 'articlecats-overridden-addition',
+        'db_connection': 'db_connection(db_server)',
+    }
+    test.teardown()
+
+    parallel_teardown = [line for line in article_logger if line.startswith('TEARDOWN')]
+    article_logger.clear()
+    test.getfixturevalues(['article_new', 'db_connection'], parallel=False)
+    test.teardown()
+    assert parallel_teardown == [line for line in article_logger if line.startswith('TEARDOWN')]
+
+
+def test_get_independent_fixture_values_in_parallel(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    barrier = threading.Barrier(2, timeout=5)
+    test.setfixture('first', lambda: barrier.wait() is not None)
+    test.setfixture('second', lambda: barrier.wait() is not None)
+
+    assert test.getfixturevalues(['first', 'second']) == {'first': True, 'second': True}
+    assert list(test.fixture_values) == ['first', 'second']
+
+
+def test_get_fixture_values_error(base_session):
+    test = base_session.get_test_by_name('test_articles')
+
+    def fail():
+        raise RuntimeError('fail')
+
+    test.setfixture('failing', fail)
+    with pytest.raises(RuntimeError):
+        test.getfixturevalues(['db', 'failing'])
+    assert 'failing' not in test.fixture_values
+    test.teardown()
+    assert test.fixture_values == {}
+
+
+def test_get_fixture_values_overriding_itself(project_copy, article_logger):
+    import pytest_ifixture as pi
+    module = project_copy.join('tests', 'tests', 'test_articles.py')
+    module.write(module.read() + """
+
+@pytest.fixture
+def db(db):
+    return db + '-overridden'
+
+
+@pytest.fixture
+def other(db_name):
+    return 'other'
+""")
+    s = pi.get_session()
+    try:
+        test = s.get_test_by_name('test_articles')
+        # db_name needed by overridden db is set up before the overriding db (only once)
+        assert pi.FixtureResolver(test.request).get_dependencies(['db', 'other']) == {
+            'db_name': [], 'db': ['db_name'], 'other': ['db_name'],
+        }
+        assert test.getfixturevalues(['db', 'other']) == {'db': 'db(db_name)-overridden', 'other': 'other'}
+        assert article_logger == ['SETUP: conftest.db_name', 'SETUP: conftest.db db_name']
+    finally:
+        s.cleanup_session()
+
+
+def test_async_fixtures(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    events = {}
+
+    @pytest.fixture
+    async def first():
+        events['first'].set()
+        await asyncio.wait_for(events['second'].wait(), 5)
+        return 'first'
+
+    @pytest.fixture
+    async def second(db):
+        events['second'].set()
+        await asyncio.wait_for(events['first'].wait(), 5)
+        yield db + ' second'
+        await asyncio.sleep(0)
+        events['teardown'] = True
+
+    test.setfixture('first', first)
+    test.setfixture('second', second)
+
+    async def main():
+        events['first'], events['second'] = asyncio.Event(), asyncio.Event()
+        values = await test.agetfixturevalues(['first', 'second'])
+        await test.ateardown()
+        return values
+
+    assert asyncio.get_event_loop().run_until_complete(main()) == {'first': 'first', 'second': 'db(db_name) second'}
+    assert events['teardown'] is True
+
+
+def test_async_fixture_on_managed_loop(base_session):
+    # loop thread is started only by the first async fixture
+    assert not [t for t in threading.enumerate() if t.name == 'ifixture-loop']
+    test = base_session.get_test_by_name('test_articles')
+    teardown = []
+
+    @pytest.fixture
+    async def async_db(db):
+        await asyncio.sleep(0)
+        yield 'async ' + db
+        teardown.append(True)
+
+    test.setfixture('async_db', async_db)
+    assert test.getfixturevalue('async_db') == 'async db(db_name)'
+    assert [t for t in threading.enumerate() if t.name == 'ifixture-loop']
+    test.teardown()
+    assert teardown == [True]
+
+
+def test_snapshot(base_session, article_logger):
+    test = base_session.get_test_by_name('test_db[cats]')
+    test.getfixturevalue('article_new')
+    setup_logger = list(article_logger)
+
+    snapshot = test.snapshot()
+    if snapshot.restored:
+        restored = test.fixture_values.get('article_new') == 'articlecats-overridden-addition'
+        os._exit(0 if restored and article_logger == setup_logger else 1)
+
+    test.teardown()
+    assert test.fixture_values == {}
+    assert base_session.restore(snapshot) == 0
+    assert base_session.restore(snapshot) == 0
+    assert list(base_session.snapshots) == [snapshot]
+
+
+def test_snapshot_limit(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    base_session.snapshots.limit = 2
+    snapshots = [test.snapshot() for _ in range(3)]
+    if any(s.restored for s in snapshots):
+        os._exit(0)
+
+    assert list(base_session.snapshots) == snapshots[1:]
+    with pytest.raises(ValueError):
+        base_session.restore(snapshots[0])
+    base_session.cleanup_session()
+    assert len(base_session.snapshots) == 0
+
+
+def test_restored_snapshot_exits_without_teardown():
+    code = """
+import sys, pytest_ifixture as pi
+s = pi.get_session()
+test = s.get_test_by_name('test_db[cats]')
+test.getfixturevalue('db_connection')
+snapshot = test.snapshot()
+if snapshot.restored:
+    sys.exit(3)
+print('RESTORED', s.restore(snapshot), flush=True)
+"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+    # session cleanup registered in atexit runs only in the process which created the session
+    restored, _, cleanup = output.partition('RESTORED 3\n')
+    assert 'TEARDOWN' not in restored
+    assert 'TEARDOWN: conftest.db_server' in cleanup
+
+
+def test_fixture_timings(base_session, tmpdir):
+    test = base_session.get_test_by_name('test_db[cats]')
+    test.getfixturevalue('db')
+    test.teardown()
+    assert test.fixture_timings == []
+
+    base_session.track_timings()
+    test.getfixturevalue('db')
+    test.teardown()
+
+    timings = [(t.fixture, t.phase, t.parent) for t in test.fixture_timings]
+    assert timings == [
+        ('db_name', 'setup', 'db'),
+        ('db', 'setup', None),
+        ('db', 'teardown', None),
+        ('db_name', 'teardown', 'db'),
+    ]
+    assert all(t.wall >= 0 and t.scope == 'function' for t in test.fixture_timings)
+
+    test.getfixturevalue('db')
+    stats = base_session.fixture_stats
+    assert stats[('db', 'setup')].count == 2
+    assert stats[('db', 'teardown')].count == 1
+
+    path = tmpdir.join('trace.json')
+    base_session.export_trace(str(path))
+    events = json.loads(path.read())['traceEvents']
+    assert [(e['name'], e['cat']) for e in events][:2] == [('db_name', 'setup'), ('db', 'setup')]
+    assert events[0]['args']['test'] == 'tests/tests/db/test_db.py::test_db[cats]'
+
+
+def test_reset_fixture_keeps_unrelated_fixtures(base_session, article_logger):
+    test = base_session.get_test_by_name('test_articles')
+
+    @pytest.fixture
+    def dynamic(request):
+        return request.getfixturevalue('db') + ' dynamic'
+
+    test.setfixture('dynamic', dynamic)
+    test.getfixturevalue('author')
+    test.getfixturevalue('dynamic')
+
+    assert test.fixture_graph == {'author': set(), 'db_name': set(), 'db': {'db_name'}, 'dynamic': {'db'}}
+    assert test.dependents('db_name') == ['dynamic', 'db']
+
+    article_logger.clear()
+    test.reset_fixture('db_name')
+    assert article_logger == ['TEARDOWN: conftest.db db_name', 'TEARDOWN: conftest.db_name']
+    assert test.fixture_values == {'author': 'adam'}
+
+    with pytest.raises(KeyError):
+        test.reset_fixture('db')
+
+
+def test_reset_fixture_resets_fixtures_using_resolved_fixture(base_session, article_logger):
+    test = base_session.get_test_by_name('test_articles')
+
+    @pytest.fixture
+    def dynamic(request):
+        return request.getfixturevalue('db') + ' dynamic'
+
+    test.setfixture('dynamic', dynamic)
+    test.getfixturevalue('db')
+    test.getfixturevalue('dynamic')  # db is already resolved
+
+    assert test.fixture_graph == {'db_name': set(), 'db': {'db_name'}, 'dynamic': {'db'}}
+    assert test.dependents('db') == ['dynamic']
+
+    test.reset_fixture('db')
+    assert test.fixture_values == {'db_name': 'db_name'}
+
+
+def test_fixture_cache(tmpdir, capsys):
+    import pytest_ifixture as pi
+    calls = []
+
+    @pytest.fixture
+    @pi.cache_fixture(salt='1')
+    def table(db):
+        calls.append(db)
+        return {'db': db, 'rows': [1, 2, 3], 'blob': bytearray(b'x' * 100)}
+
+    for _ in range(2):
+        s = pi.get_session(['-o', f'cache_dir={tmpdir}'])
+        test = s.get_test_by_name('test_articles')
+        test.setfixture('table', table)
+        assert test.getfixturevalue('table') == {'db': 'db(db_name)', 'rows': [1, 2, 3], 'blob': b'x' * 100}
+        s.cleanup_session()
+
+    assert calls == ['db(db_name)']
+    assert s.fixture_cache.stats['hit'] == 1
+    [entry] = s.fixture_cache.entries()
+    assert entry.fixture == 'table'
+
+    capsys.readouterr()
+    pi.main(['cache', 'list', '--dir', s.fixture_cache.path])
+    assert 'table' in capsys.readouterr().out
+    pi.main(['cache', 'purge', '--dir', s.fixture_cache.path, '--fixture', 'table'])
+    assert s.fixture_cache.entries() == []
+
+
+def test_fixture_cache_of_async_fixture(tmpdir):
+    import pytest_ifixture as pi
+    calls = []
+
+    @pytest.fixture
+    @pi.cache_fixture
+    async def rows(db):
+        await asyncio.sleep(0)
+        calls.append(db)
+        return [db, 1, 2]
+
+    @pytest.fixture(scope='session')
+    @pi.cache_fixture
+    def session_rows(db):
+        return [db]
+
+    for first in (True, False):
+        s = pi.get_session(['-o', f'cache_dir={tmpdir}'])
+        try:
+            test = s.get_test_by_name('test_articles')
+            test.setfixture('rows', rows)
+            test.setfixture('session_rows', session_rows)
+            # awaited value is cached, not the coroutine
+            assert test.getfixturevalue('rows') == ['db(db_name)', 1, 2]
+            # size is counted only when a value is stored
+            assert s.fixture_cache.size == (s.fixture_cache.entries()[0].size if first else None)
+            # scope of dependencies is checked also for cached values
+            with pytest.raises(pytest.fail.Exception, match='ScopeMismatch'):
+                test.getfixturevalue('session_rows')
+        finally:
+            s.cleanup_session()
+
+    assert calls == ['db(db_name)']
+    assert s.fixture_cache.stats == {'hit': 1, 'miss': 1, 'bypass': 0}
+
+
+def test_fixture_cache_key_depends_on_dependencies(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    base_session.fixture_cache.add('db')
+    base_session.fixture_cache.max_size = 0
+    test.setfixture('db_name', 'first')
+    assert test.getfixturevalue('db') == 'db(first)'
+    test.teardown(remove_custom_fixtures=True)
+
+    test.setfixture('db_name', 'second')
+    assert test.getfixturevalue('db') == 'db(second)'
+    assert base_session.fixture_cache.stats == {'hit': 0, 'miss': 2, 'bypass': 0}
+    assert len(base_session.fixture_cache.entries()) == 1
+    base_session.fixture_cache.purge()
+
+
+def test_fixture_cache_key_does_not_depend_on_hash_seed():
+    code = "import pytest_ifixture as pi; print(pi._hash_value([{'a', 'b', 'c'}, frozenset({b'x', b'y'}), {'d': 1}]))"
+    hashes = set()
+    for seed in ['1', '2', '3']:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), PYTHONHASHSEED=seed)
+        hashes.add(subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True))
+    assert len(hashes) == 1
+
+
+def test_state_events(base_session):
+    events = []
+    base_session.subscribe(events.append)
+    test = base_session.get_test_by_name('test_articles')
+
+    test.setfixture('author', 'eve')
+    test.getfixturevalue('db')
+    assert base_session.active_test == test
+    assert base_session.state.test is test.test
+
+    test.reset_fixture('db_name')
+    test.teardown()
+    assert base_session.active_test is None
+
+    base_session.unsubscribe(events.append)
+    test.getfixturevalue('db_name')
+    test.teardown()
+
+    assert [(e.kind, e.fixture) for e in events] == [
+        ('override', 'author'),
+        ('setup', 'db_name'),
+        ('setup', 'db'),
+        ('teardown', 'db'),
+        ('teardown', 'db_name'),
+        ('reset', 'db_name'),
+    ]
+    assert {e.test for e in events} == {test.test.nodeid}
+
+
+def test_track_state(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    test.getfixturevalue('db')
+    assert not base_session.state.enabled
+    assert base_session.active_test == test
+
+    # fixtures resolved before tracking started are found in the setup state
+    base_session.track_state()
+    assert base_session.state.test is test.test
+    assert sorted(f.argname for f in base_session.state.resolved) == ['db', 'db_name']
+    test.teardown()
+    assert base_session.state.test is None and base_session.active_test is None
+
+    base_session.track_state(False)
+    test.getfixturevalue('db')
+    assert base_session.state.test is None
+    assert base_session.active_test == test
+
+
+def test_session_override(base_session, capsys):
+    db_test = base_session.get_test_by_name('test_db[cats]')
+    db_test.getfixturevalue('db')
+    with pytest.raises(ValueError):
+        base_session.override({'db_name': 'test-db'})
+    db_test.teardown()
+    capsys.readouterr()
+
+    with base_session.override({'db_name': 'test-db', 'new_fixture': lambda: 42}):
+        assert db_test.getfixturevalue('db') == 'db(test-db)'
+        assert db_test.getfixturevalue('new_fixture') == 42
+        db_test.teardown()
+        articles_test = base_session.get_test_by_name('test_articles')
+        assert articles_test.getfixturevalue('db') == 'db(test-db)'
+        articles_test.teardown(remove_custom_fixtures=True)
+        assert articles_test.getfixturevalue('db') == 'db(test-db)'
+    assert articles_test.fixture_values == {}
+    assert 'adding' not in capsys.readouterr().out
+
+    assert articles_test.getfixturevalue('db') == 'db(db_name)'
+    with pytest.raises(FixtureLookupError):
+        articles_test.getfixturevalue('new_fixture')
+
+
+def test_set_fixtures(base_session):
+    test = base_session.get_test_by_name('test_articles')
+    test.getfixturevalue('author')
+    with pytest.raises(ValueError):
+        test.setfixtures({'db_name': 'new name', 'author': 'eve'})
+    assert test.getfixturevalue('db') == 'db(db_name)'
+
+    test.teardown()
+    test.setfixtures({'db_name': 'new name', 'author': 'eve'})
+    assert test.getfixturevalue('db') == 'db(new name)'
+    assert test.getfixturevalue('author') == 'eve'
+
+
+def test_share_fixtures_of_variants(base_session, article_logger):
+    dogs = base_session.get_test_by_name('test_db[dogs]')
+    assert dogs.getfixturevalue('article_new') == 'articledogs-overridden-addition'
+    del article_logger[:]
+
+    with pytest.raises(ValueError):
+        base_session.get_test_by_name('test_db[cats]')
+    cats = base_session.get_test_by_name('test_db[cats]', share_fixtures=True)
+    assert base_session.active_test == cats
+    assert sorted(cats.fixture_values) == ['db', 'db_name']
+    assert not dogs.fixture_values
+    assert 'TEARDOWN: articledogs db(db_name-2)' in article_logger
+    assert not [log for log in article_logger if 'db_name-2' in log and 'article' not in log]
+
+    del article_logger[:]
+    assert cats.getfixturevalue('article_new') == 'articlecats-overridden-addition'
+    assert 'SETUP: articlecats db(db_name-2)' in article_logger
+    assert not [log for log in article_logger if 'article' not in log]
+
+    cats.teardown()
+    assert base_session.active_test is None
+    assert 'TEARDOWN: test_db.db_name' in article_logger
+
+
+class Payload:
+    def __init__(self, size):
+        self.data = bytearray(size)
+
+
+def test_memory_report(base_session):
+    kept = []
+    test = base_session.get_test_by_name('test_articles')
+    base_session.track_memory()
+    try:
+        fixtures = {'payload': lambda: Payload(2 ** 20), 'leaked': lambda: kept.append(Payload(1)) or kept[-1]}
+        with base_session.override(fixtures):
+            test.getfixturevalue('payload')
+            test.getfixturevalue('leaked')
+            test.getfixturevalue('db_name')
+            test.reset_fixture('payload')
+            assert test.memory_report.leaks == []
+            test.teardown()
+    finally:
+        base_session.track_memory(False)
+
+    report = test.memory_report
+    sizes = report.by_fixture()
+    assert sizes['payload'][0] == 1 and sizes['payload'][1] >= 2 ** 20
+    payload = next(a for a in report.allocations if a.fixture == 'payload')
+    assert payload.sites and payload.sites[0][1] >= 2 ** 20
+    assert [(leak.fixture, leak.type) for leak in report.leaks] == [('leaked', 'Payload')]
+    assert 'list' in report.leaks[0].referrers
+    assert 'LEAK: leaked' in str(base_session.memory_report)
+
+
+def test_run(base_session, article_logger):
+    test = base_session.get_test_by_name('test_articles')
+    stats = test.run(repeat=3, warmup=1)
+    assert stats.test == test.test.nodeid
+    assert len(stats.wall) == len(stats.cpu) == 3 and stats.profile is None
+    assert stats.min <= stats.median <= stats.p95 == max(stats.wall)
+    # function scoped fixtures are set up for every call, finalizer added by the test is called between calls
+    assert article_logger.count('SETUP: test_articles.author') == 4
+    assert article_logger.count('TEARDOWN: article-overridden-full') == 3
+    assert 'runs, min' in str(stats)
+
+    del article_logger[:]
+    stats = test.run(repeat=2, reset=False, profile=True)
+    assert article_logger == ['SETUP: article-overridden-full', 'SETUP: article-overridden-full']
+    assert any(func[2] == 'test_articles' for func in stats.profile.stats)
+    with pytest.raises(ValueError):
+        test.run(repeat=0)
+
+
+def test_run_coroutine_test(base_session, monkeypatch):
+    test = base_session.get_test_by_name('test_articles')
+    calls = []
+
+    async def test_articles(article, request, author):
+        await asyncio.sleep(0)
+        calls.append(threading.current_thread().name)
+
+    monkeypatch.setattr(test.test, 'obj', test_articles)
+    stats = test.run(repeat=2, profile=True)
+    # coroutine is awaited on the loop of async fixtures
+    assert calls == ['ifixture-loop', 'ifixture-loop']
+    assert len(stats.wall) == 2
+    assert any(func[2] == 'test_articles' for func in stats.profile.stats)
+
+
+def test_deferred_teardowns(base_session):
+    release = threading.Event()
+    events = []
+
+    def slow():
+        yield 'slow'
+        release.wait(5)
+        events.append('slow finished')
+
+    def broken():
+        yield 'broken'
+        raise RuntimeError('broken teardown')
+
+    class PostFinalizer:
+        def pytest_fixture_post_finalizer(self, fixturedef):
+            if fixturedef.argname == 'slow':
+                events.append(('post finalizer', fixturedef.cached_result[0]))
+
+    base_session.config.pluginmanager.register(PostFinalizer(), 'test-post-finalizer')
+    base_session.defer_teardowns()
+    with base_session.override({'slow': slow, 'broken': broken}):
+        test = base_session.get_test_by_name('test_articles')
+        test.getfixturevalues(['slow', 'broken', 'author'], parallel=False)
+        test.teardown()
+        # finalizers are still running, but the fixtures are detached
+        assert base_session.active_test is None and test.fixture_values == {}
+        other = base_session.get_test_by_name('test_db[cats]')
+        assert other.getfixturevalue('db') == 'db(db_name-2)'
+        other.teardown()
+
+        # setup of the fixture waits for its pending teardown, cached value is kept for the finalizers
+        threading.Timer(0.1, release.set).start()
+        assert test.getfixturevalue('slow') == 'slow'
+        assert events == ['slow finished', ('post finalizer', 'slow')]
+
+        test.getfixturevalue('broken')
+        test.reset_fixture('broken')
+        with pytest.raises(RuntimeError, match='broken teardown'):
+            base_session.wait_teardowns()
+        # errors are raised only once
+        base_session.wait_teardowns()
+        assert base_session.active_test == test
+        test.teardown()
+    base_session.defer_teardowns(False)
+    base_session.config.pluginmanager.unregister(name='test-post-finalizer')
+    assert events[2:] == ['slow finished', ('post finalizer', 'slow')]
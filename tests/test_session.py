@@ -1,3 +1,10 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
 import pytest
 
 
@@ -6,6 +13,29 @@ def test_session(base_session):
     assert tests == ['test_articles', 'test_db[dogs]', 'test_db[cats]']
 
 
+def test_import_is_lazy():
+    code = 'import sys, pytest_ifixture; print(sorted(m for m in ("_pytest", "py") if m in sys.modules))'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+    assert output.strip() == '[]'
+
+
+def test_minimal_profile():
+    import pytest_ifixture as pi
+    s = pi.get_session(profile='minimal')
+    try:
+        plugins = s.session.config.pluginmanager
+        assert plugins.get_plugin('pastebin') is None
+        assert plugins.get_plugin('stepwiseplugin') is None
+        test = s.get_test_by_name('test_db[cats]')
+        assert test.getfixturevalue('db') == 'db(db_name-2)'
+        # builtin fixtures are available
+        assert test.getfixturevalue('caplog') is not None
+        assert callable(test.getfixturevalue('record_property'))
+    finally:
+        s.cleanup_session()
+
+
 def test_get_test_by_name(base_session):
     # non existing test raise error
     with(pytest.raises(ValueError)):
@@ -58,3 +88,451 @@ def test_can_be_used_and_active(base_session):
     assert all([t.can_be_used for t in base_session.tests])
     assert not any([t.active for t in base_session.tests])
 
+
+
+def test_get_test_by_nodeid(base_session):
+    with(pytest.raises(ValueError)):
+        base_session.get_test_by_nodeid('non existing')
+
+    test = base_session.get_test_by_nodeid('tests/tests/db/test_db.py::test_db[cats]')
+    assert test.test.name == 'test_db[cats]'
+
+
+def test_get_tests_by_module_marker_and_keyword(base_session):
+    assert [t.test.name for t in base_session.get_tests_for_module('test_db')] == ['test_db[dogs]', 'test_db[cats]']
+    assert [t.test.name for t in base_session.get_tests_for_module('tests/tests/test_articles.py')] == ['test_articles']
+    assert len(base_session.get_tests_for_marker('parametrize')) == 0
+    assert [t.test.name for t in base_session.get_tests_for_marker('slow')] == ['test_db[dogs]', 'test_db[cats]']
+    assert [t.test.name for t in base_session.get_tests_for_keyword('cats')] == ['test_db[cats]']
+    assert base_session.get_tests_for_fixture('non existing') == []
+
+
+def test_tests_are_cached(base_session):
+    assert base_session.tests[0] is base_session.tests[0]
+    assert base_session.get_test_by_name('test_articles') is base_session.tests[0]
+
+
+def test_index_is_rebuilt_when_items_change(base_session):
+    assert len(base_session.get_tests_for_fixture('db')) == 3
+    base_session.session.items = base_session.session.items[1:]
+    tests = base_session.get_tests_for_fixture('db')
+    assert len(tests) == 2
+    assert tests[0].test is base_session.session.items[0]
+
+
+def test_collection_cache(tmpdir):
+    import pytest_ifixture as pi
+
+    def get_session():
+        return pi.get_session(['-o', f'cache_dir={tmpdir}'], collection_cache=True)
+
+    s = get_session()
+    assert s.index.loader is None
+    s.cleanup_session()
+
+    s = get_session()
+    try:
+        assert s.index.loader is not None
+        assert s.session.items == []
+        test = s.get_test_by_name('test_articles')
+        assert [t.name for t in s.session.items] == ['test_articles']
+        assert test.getfixturevalue('db') == 'db(db_name)'
+        test.teardown()
+        assert len(s.get_tests_for_fixture('article_new')) == 2
+        assert [t.test.name for t in s.tests] == ['test_articles', 'test_db[dogs]', 'test_db[cats]']
+    finally:
+        s.cleanup_session()
+
+
+def test_collection_cache_invalidated(tmpdir):
+    import pytest_ifixture as pi
+    pi.get_session(['-o', f'cache_dir={tmpdir}'], collection_cache=True).cleanup_session()
+
+    module = Path('tests', 'tests', 'test_articles.py')
+    stat = module.stat()
+    os.utime(module, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        s = pi.get_session(['-o', f'cache_dir={tmpdir}'], collection_cache=True)
+        assert s.index.loader is None
+        assert len(s.session.items) == 3
+        s.cleanup_session()
+    finally:
+        os.utime(module, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_collection_cache_depends_on_inifile_and_plugins(project_copy):
+    import pytest_ifixture as pi
+    args = ['-o', f'cache_dir={project_copy}']
+    pi.get_session(args, collection_cache=True).cleanup_session()
+
+    # other plugins
+    s = pi.get_session(args, collection_cache=True, profile='minimal')
+    assert s.index.loader is None
+    s.cleanup_session()
+
+    # new ini file
+    project_copy.join('pytest.ini').write('[pytest]\n')
+    s = pi.get_session(args, collection_cache=True)
+    assert s.index.loader is None
+    s.cleanup_session()
+    s = pi.get_session(args, collection_cache=True)
+    assert s.index.loader is not None
+    s.cleanup_session()
+
+    # changed ini file
+    project_copy.join('pytest.ini').write('[pytest]\nmarkers =\n    slow\n')
+    s = pi.get_session(args, collection_cache=True)
+    assert s.index.loader is None
+    s.cleanup_session()
+
+
+def test_refresh_changed_module(project_copy, article_logger):
+    import pytest_ifixture as pi
+    s = pi.get_session()
+    try:
+        db_test = s.get_test_by_name('test_db[cats]')
+        db_test.getfixturevalue('db_name')
+
+        module = project_copy.join('tests', 'tests', 'test_articles.py')
+        module.write(module.read().replace("return 'adam'", "return 'eve'"))
+        assert s.changed_files() == [str(module)]
+        assert s.refresh() == [str(module)]
+        assert s.changed_files() == []
+
+        assert db_test.active
+        assert article_logger == ['SETUP: test_db.db_name']
+        db_test.teardown()
+
+        assert [t.test.name for t in s.tests] == ['test_articles', 'test_db[dogs]', 'test_db[cats]']
+        assert s.tests[2] is db_test
+        assert s.get_test_by_name('test_articles').getfixturevalue('author') == 'eve'
+    finally:
+        s.cleanup_session()
+
+
+def test_refresh_changed_conftest(project_copy, article_logger):
+    import pytest_ifixture as pi
+    s = pi.get_session()
+    try:
+        s.get_test_by_name('test_db[cats]').getfixturevalue('db')
+
+        conftest = project_copy.join('tests', 'conftest.py')
+        conftest.write(conftest.read().replace("yield f'{db.__name__}({db_name})'", "yield f'database({db_name})'"))
+        s.refresh()
+
+        assert s.active_test is None
+        assert s.get_test_by_name('test_db[cats]').getfixturevalue('db') == 'database(db_name-2)'
+        assert len(s.config.pluginmanager._conftest_plugins) == 1
+    finally:
+        s.cleanup_session()
+
+
+def test_watch(project_copy):
+    import pytest_ifixture as pi
+    s = pi.get_session()
+    watcher = s.watch(interval=0.01)
+    try:
+        module = project_copy.join('tests', 'tests', 'test_articles.py')
+        module.write(module.read().replace("return 'adam'", "return 'eve'"))
+        for _ in range(100):
+            if not s.changed_files():
+                break
+            time.sleep(0.01)
+        assert s.changed_files() == []
+    finally:
+        watcher.stop()
+        watcher.join()
+        s.cleanup_session()
+    assert s.get_test_by_name('test_articles').test.module.author.__wrapped__() == 'eve'
+
+
+def test_lazy_session():
+    import pytest_ifixture as pi
+    s = pi.get_session(lazy=True)
+    try:
+        assert s.session.items == []
+        assert s.get_test_by_name('test_db[cats]').test.name == 'test_db[cats]'
+        assert [t.name for t in s.session.items] == ['test_db[dogs]', 'test_db[cats]']
+
+        assert [t.test.name for t in s.get_tests_for_fixture('author')] == ['test_articles']
+        assert len(s.get_tests_for_fixture('db')) == 3
+        assert len(s.index.loader.loaded) == 2
+        # lazily loaded items keep the collection order
+        assert [t.name for t in s.session.items] == ['test_articles', 'test_db[dogs]', 'test_db[cats]']
+        assert [t.test.name for t in s.get_tests_for_fixture('db')] == [t.name for t in s.session.items]
+    finally:
+        s.cleanup_session()
+
+
+def test_lazy_session_loads_only_needed_modules():
+    import pytest_ifixture as pi
+    s = pi.get_session(lazy=True)
+    try:
+        assert [t.test.name for t in s.get_tests_for_fixture('article_new')] == ['test_db[dogs]', 'test_db[cats]']
+        assert [t.name for t in s.session.items] == ['test_db[dogs]', 'test_db[cats]']
+        assert s.get_test_by_nodeid('tests/tests/test_articles.py::test_articles').test.name == 'test_articles'
+        with pytest.raises(ValueError):
+            s.get_test_by_name('non existing')
+    finally:
+        s.cleanup_session()
+
+
+def test_switch_to(base_session, article_logger):
+    cats = base_session.get_test_by_name('test_db[cats]')
+    cats.getfixturevalue('db_connection')
+    cats.getfixturevalue('db_name')
+
+    dogs = base_session.switch_to('test_db[dogs]')
+    assert dogs.active
+    assert not cats.can_be_used
+    assert dogs.getfixturevalue('db_connection') == 'db_connection(db_server)'
+    assert article_logger == [
+        'SETUP: conftest.db_server',
+        'SETUP: test_db.db_connection db_server',
+        'SETUP: test_db.db_name',
+        'TEARDOWN: test_db.db_name',
+    ]
+
+    article_logger.clear()
+    articles = base_session.switch_to(base_session.tests[0])
+    assert articles.getfixturevalue('db_server') == 'db_server'
+    assert article_logger == ['TEARDOWN: test_db.db_connection db_server']
+
+    article_logger.clear()
+    articles.teardown()
+    assert article_logger == ['TEARDOWN: conftest.db_server']
+
+
+def test_teardown_fixtures_of_all_scopes(base_session, article_logger):
+    test = base_session.get_test_by_name('test_db[cats]')
+    test.getfixturevalue('db_connection')
+    test.getfixturevalue('db')
+    article_logger.clear()
+
+    # function scoped fixtures first, then module and session scoped ones
+    test.teardown()
+    assert article_logger == [
+        'TEARDOWN: conftest.db db_name-2',
+        'TEARDOWN: test_db.db_name',
+        'TEARDOWN: test_db.db_connection db_server',
+        'TEARDOWN: conftest.db_server',
+    ]
+    assert test.fixture_values == {}
+
+
+def test_map_tests(base_session):
+    results = base_session.map_tests(lambda values: values.get('article_new', values['db']), workers=2)
+    assert sorted(results) == [
+        ('tests/tests/db/test_db.py::test_db[cats]', 'articlecats-overridden-addition', None),
+        ('tests/tests/db/test_db.py::test_db[dogs]', 'articledogs-overridden-addition', None),
+        ('tests/tests/test_articles.py::test_articles', 'db(db_name)', None),
+    ]
+    assert base_session.active_test is None
+
+
+def test_map_tests_of_two_sessions(base_session):
+    import pytest_ifixture as pi
+    other = pi.get_session(profile='minimal')
+    try:
+        first = base_session.map_tests(lambda values: ('first', values['db']), tests=['test_articles'], workers=1)
+        second = other.map_tests(lambda values: ('second', values['db']), tests=['test_db[cats]'], workers=1)
+        assert next(second).result == ('second', 'db(db_name-2)')
+        assert next(first).result == ('first', 'db(db_name)')
+        assert list(first) == list(second) == []
+    finally:
+        other.cleanup_session()
+
+
+def test_map_tests_error(base_session):
+    def fail(values):
+        raise RuntimeError('fail')
+
+    [result] = base_session.map_tests(fail, tests=['test_articles'], workers=1)
+    assert result.nodeid == 'tests/tests/test_articles.py::test_articles'
+    assert 'RuntimeError: fail' in result.error
+
+    base_session.get_test_by_name('test_articles').getfixturevalue('db')
+    with pytest.raises(ValueError):
+        base_session.map_tests(fail)
+
+
+def test_session_iter_lines(base_session):
+    lines = base_session.iter_lines()
+    assert next(lines).startswith('####')
+    assert '\n'.join(base_session.iter_lines()) == str(base_session)
+    assert str(base_session.get_test_by_name('test_articles')) in str(base_session)
+
+
+def test_source_index(tmpdir):
+    import importlib.util
+    import pytest_ifixture as pi
+
+    path = tmpdir.join('module_with_fixture.py')
+    path.write('def fixture():\n    return 1\n')
+    spec = importlib.util.spec_from_file_location('module_with_fixture', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    index = pi.SourceIndex()
+    assert index.location(module.fixture, tmpdir) == 'module_with_fixture.py:2'  # same as _pytest.compat.getlocation
+    assert index.source(module.fixture) == 'def fixture():\n    return 1\n'
+
+    # source is resolved again only when the file changes
+    path.write('def fixture():\n    return 2\n')
+    t = time.time() + 1
+    os.utime(str(path), (t, t))
+    assert index.source(module.fixture) == 'def fixture():\n    return 2\n'
+
+
+def test_reload_is_not_partial(tmpdir):
+    import importlib.util
+    import pytest_ifixture as pi
+    source = 'def first():\n    return {}\n\n\nclass Helper:\n    def value(self):\n        return {}\n'
+    path = tmpdir.join('module_with_fixtures.py')
+    path.write(source.format(1, 1))
+    spec = importlib.util.spec_from_file_location('module_with_fixtures', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sources = pi.FixtureSources(pi.TestIndex())
+    sources.sources[str(path)] = path.read_binary()
+
+    # value can't be reloaded in place (super needs __class__ cell), so first is not reloaded either
+    path.write(source.format(2, 'super().__sizeof__()'))
+    assert sources.reload(module, str(path), None) is None
+    assert module.first() == 1 and module.Helper().value() == 1
+
+    path.write(source.format(2, 2))
+    assert sources.reload(module, str(path), None) == {module.first, module.Helper.value}
+    assert module.first() == 2 and module.Helper().value() == 2
+
+
+def test_fixture_server(tmpdir):
+    import pytest_ifixture as pi
+
+    path = str(tmpdir.join('ifixture.sock'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    server = subprocess.Popen([sys.executable, '-m', 'pytest_ifixture', 'serve', '--socket', path],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+
+        with pi.FixtureClient(path) as client, pi.FixtureClient(path) as other_client:
+            assert 'tests/tests/test_articles.py::test_articles' in client.tests()
+            assert client.getfixturevalue('test_articles', 'db') == 'db(db_name)'
+            assert other_client.active_test() == 'tests/tests/test_articles.py::test_articles'
+
+            # one active test for all clients
+            with pytest.raises(ValueError):
+                other_client.getfixturevalue('test_db[cats]', 'db')
+            assert other_client.run(dict, test='test_articles', fixtures=['db']) == {'db': 'db(db_name)'}
+
+            # large buffers are passed in shared memory (python 3.8+)
+            assert bytes(other_client.run(bytes, args=(2 ** 20,))) == bytes(2 ** 20)
+
+            client.teardown()
+            assert other_client.getfixturevalue('test_db[cats]', 'db') == 'db(db_name-2)'
+            client.shutdown()
+        assert server.wait(10) == 0
+        assert not os.path.exists(path)
+    finally:
+        server.kill()
+
+
+def test_reload_fixtures(project_copy, article_logger):
+    import pytest_ifixture as pi
+    s = pi.get_session()
+    try:
+        test = s.get_test_by_name('test_articles')
+        test.getfixturevalue('article')
+        with pytest.raises(ValueError):
+            s.reload_fixtures()
+        # sources of already resolved fixtures are kept too
+        s.track_sources()
+        test.getfixturevalue('author')
+        del article_logger[:]
+
+        conftest = project_copy.join('tests', 'conftest.py')
+        conftest.write(conftest.read().replace("yield f'{db.__name__}({db_name})'", "yield f'database({db_name})'"))
+        t = time.time() + 1
+        os.utime(str(conftest), (t, t))
+
+        # db and article depending on it are reset, db_name and author stay resolved
+        assert sorted(s.reload_fixtures()) == ['article', 'db']
+        assert s.changed_files() == []
+        assert article_logger == ['TEARDOWN: test_articles.article db(db_name)', 'TEARDOWN: conftest.db db_name']
+        assert sorted(test.fixture_values) == ['author', 'db_name']
+        assert test.getfixturevalue('article') == 'article-overridden-full'
+        assert test.fixture_values['db'] == 'database(db_name)'
+
+        # other changes are left for refresh
+        conftest.write(conftest.read() + '\n\nVALUE = 1\n')
+        t = time.time() + 2
+        os.utime(str(conftest), (t, t))
+        assert s.reload_fixtures() == []
+        assert s.changed_files() == [str(conftest)]
+    finally:
+        s.cleanup_session()
+
+
+def test_close_session():
+    import atexit
+    import pytest_ifixture as pi
+    args = ['tests']
+    with pi.get_session(args) as s:
+        assert args == ['tests']
+        assert s.get_test_by_name('test_db[cats]').getfixturevalue('db') == 'db(db_name-2)'
+        assert not s.closed
+    assert s.closed
+    assert s.index.by_nodeid == {} and s.session.items == []
+    assert s.config.pluginmanager.get_plugin('ifixture-index') is None
+    assert 'ifixture-loop' not in [t.name for t in threading.enumerate()]
+    s.close()
+    assert atexit.unregister(s.cleanup_session) is None
+
+
+def test_session_pool(article_logger):
+    import pytest_ifixture as pi
+    with pi.SessionPool() as pool:
+        s = pool.get(['tests'])
+        s.get_test_by_name('test_articles').getfixturevalue('db_name')
+        assert pool.get(['tests']) is s
+        assert s.active_test is None
+        assert article_logger == ['SETUP: conftest.db_name', 'TEARDOWN: conftest.db_name']
+        assert pool.get(['tests'], profile='minimal') is not s
+        assert len(pool) == 2
+    assert s.closed and len(pool) == 0
+
+
+def test_check_fixtures(project_copy):
+    import pytest_ifixture as pi
+    module = project_copy.join('tests', 'tests', 'test_articles.py')
+    module.write(module.read() + '\n\ndef test_articles_copy(article, request, author):\n    pass\n')
+
+    def broken_db():
+        raise RuntimeError('broken db')
+
+    with pi.get_session() as s:
+        report = s.check_fixtures(workers=2)
+        assert [r.status for r in report.results] == ['passed'] * 4
+        copy = report.results[1]
+        assert copy.nodeid.endswith('::test_articles_copy') and copy.same_as == report.results[0].nodeid
+        assert report.results[0].setup > 0 and 'author' in report.results[0].fixtures
+        assert report.as_dict()['checked'] == 3
+        assert s.active_test is None
+
+        with s.override({'db': broken_db}):
+            report = s.check_fixtures(tests=['test_db[dogs]', 'test_articles'], workers=1)
+        assert [r.status for r in report.results] == ['failed', 'failed']
+        assert 'RuntimeError: broken db' in report.failures[0].error
+
+
+def test_check_fixtures_cli(capsys):
+    import json
+    import pytest_ifixture as pi
+    assert pi.main(['check', '--workers', '2', '--', 'tests']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['tests'] == 3 and report['failed'] == 0
+    assert [r['status'] for r in report['results']] == ['passed'] * 3
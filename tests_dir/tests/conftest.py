@@ -27,3 +27,10 @@ def article(db, request):
     return article.__name__ + title
 
 
+
+
+@pytest.fixture(scope='session')
+def db_server():
+    log_setup(db_server)
+    yield db_server.__name__
+    log_teardown(db_server)
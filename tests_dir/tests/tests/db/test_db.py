@@ -9,6 +9,13 @@ def db_name():
     log_teardown(db_name)
 
 
+@pytest.fixture(scope='module')
+def db_connection(db_server):
+    log_setup(db_connection, db_server)
+    yield f'{db_connection.__name__}({db_server})'
+    log_teardown(db_connection, db_server)
+
+
 @pytest.fixture
 def article_new(article, db):
     log_setup(article, db)
@@ -16,6 +23,7 @@ def article_new(article, db):
     log_teardown(article, db)
 
 
+@pytest.mark.slow
 def test_db(article_new, request):
     log_setup(test_db, article_new)
     request.addfinalizer(lambda: log_teardown(test_db, article_new))